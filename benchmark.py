@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+benchmarks for the xml correction pipeline. the reference implementations
+that optimized functions are checked and timed against live here, not in
+xml_correction.py
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+
+import header_rewrite
+import manifest
+import xml_backend
+import xml_correction
+
+
+def preprocess_xml_old(xml_file):
+    """the original, multi-pass version of xml_correction.preprocess_xml.
+    take an xml file, read the contents, and prepare it for processing by
+    ElementTree. Most importantly, this function removes namespaces from the xml,
+    which hinder functionality"""
+
+    with open(xml_file, 'r', encoding="utf-8") as f:
+        xml_text = f.read()
+    # strip xml declarations (lines starting with <?xml) from the xml string
+    xml_text = re.sub(r'\<\?xml[^\>]+\>\n', "", xml_text)
+    # remove schema and namespace information, which can cause issues when the
+    # xml is processed
+    xml_text = re.sub(r'<(\w+) (?:xsi:schemaLocation|xmlns)[^>]+>', r"<\1>", xml_text)
+    # strip all non-unicode characters
+    xml_text = re.sub(r'[^\x00-\x7F]+', '', xml_text)
+    # remove namespace for easier parsing
+    xml_text = re.sub(r'\<(\w+)\sxmlns=.+\>\n', r"<\1>", xml_text)
+
+    return xml_text
+
+
+def same_preprocessed_tree(xml_file):
+    """checks that preprocess_xml and preprocess_xml_old parse to the same tree.
+    the trees are compared, not the text: the old version reads in text mode,
+    which turns CRLF into LF, while the new one leaves CRLF for the parser"""
+    new_tree = ET.tostring(ET.fromstring(xml_correction.preprocess_xml(xml_file)))
+    old_tree = ET.tostring(ET.fromstring(preprocess_xml_old(xml_file)))
+    return new_tree == old_tree
+
+
+def benchmark_preprocess(xml_file, repeat=20):
+    """times preprocess_xml against preprocess_xml_old on a single file,
+    and checks that they produce the same xml"""
+    assert same_preprocessed_tree(xml_file), "preprocess output differs for " + xml_file
+    for preprocess in (preprocess_xml_old, xml_correction.preprocess_xml):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            preprocess(xml_file)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(preprocess.__name__, ": ", round(elapsed * 1000, 3), "ms per file")
+
+
+def extract_params_from_htm_old(htm_file, p_term):
+    """the original, whole-file version of xml_correction.extract_params_from_htm"""
+    text_dict = {}
+    if p_term == "params":
+        p_term = "Parameters"
+    else:
+        p_term = p_term[0].upper() + p_term[1:]
+    htm_lines = open(htm_file).read().replace('\n', '')
+    param_html = re.search('<h2>' + p_term + '</h2>(.+?)<h2>', htm_lines).group()
+    for param in re.findall(r'<dt>(?:<\w+?>)(\w+).*?</dt>\s*<dd>(.+?)</dd>', param_html):
+        text_dict[param[0].strip()] = xml_correction.alter_html_tags(param[1].strip())
+    return text_dict
+
+
+def rewrite_header_old(content, md_headers, filename=""):
+    """the original, multi-pass header fix from header_mismatch.py, that
+    header_rewrite.rewrite_header replaces"""
+    header = re.search(r"\<header\>\s*<filename>([\w\.]+)\s*</filename>",content)
+    if header:
+        header = header.group(1)
+    include_headers= re.findall(r"<include_header>\s*<filename>([\w\.]+)\s*</filename>\s*</include_header", content)
+    new_include = []
+    for h in include_headers:
+        if h.lower() not in [x.lower() for x in new_include]:
+            new_include.append(h)
+    if header and header.lower() not in [x.lower() for x in new_include]:
+        new_include.append(header)
+    new_header = "<header><filename>"+ md_headers + "</filename>\n"
+    if "</header>" not in content:
+        new_header += "</header>"
+    new_include_str = ""
+    for include in new_include:
+        new_include_str += "<include_header><filename>"+include+"</filename></include_header>\n"
+    if header is not None:
+        content = re.sub(r"\<header\>\s*<filename>.+?</filename>", new_header, content)
+    else:
+        try:
+            assert "<info>" in content
+            content = re.sub("<info>", "<info>\n"+new_header+"\n", content)
+        except AssertionError:
+            assert "<info/>" in content, filename+" does not have an info tag"
+            content = re.sub("<info/>", "<info>\n"+new_header+"\n</info>", content)
+    if new_include:
+        if "<include_header>" in content:
+            content = re.sub(r"<include_header>.+</include_header>", new_include_str, content)
+        else:
+            content = re.sub(r"</header>",new_include_str+"\n"+"</header>", content)
+    return content
+
+
+def benchmark_rewrite_header(content, repeat=20):
+    """times header_rewrite.rewrite_header against rewrite_header_old on
+    a document, and checks that they produce the same content"""
+    assert header_rewrite.rewrite_header(content, "new.h") == rewrite_header_old(content, "new.h")
+    for rewrite in (rewrite_header_old, header_rewrite.rewrite_header):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rewrite(content, "new.h")
+        elapsed = (time.perf_counter() - start) / repeat
+        print(rewrite.__name__, ": ", round(elapsed * 1000, 3), "ms per file")
+
+
+SAMPLE_ROOT_ATTRIBUTES = ' xsi:schemaLocation="http://microsoft.com/wdcml ../../BuildX/Schema/xsd/wdcml.xsd"' \
+    ' xmlns="http://microsoft.com/wdcml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+SAMPLE_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n' \
+    '<?xml-stylesheet type="text/xsl" href="../../BuildX/Script2/preview.xslt"?>\n'
+
+
+def write_sample_topic(folder, sections, params=4):
+    """writes a WDCML-shaped stub, original and htm page to folder, with
+    sections remarks sections in the original. returns (htm, stub, orig) paths"""
+    names = ["Param" + str(i) for i in range(params)]
+    stub_params = "".join("<param><name>" + name + "</name><desc><p>stub</p></desc></param>\n"
+                          for name in names)
+    orig_params = stub_params.replace("stub", "orig")
+    remarks = "".join('<section><title>Section ' + str(i) + '</title><p>Remark text with '
+                      '<b>markup</b> and a <xref rid="x' + str(i) + '">link</xref>.</p></section>\n'
+                      for i in range(sections))
+    stub = SAMPLE_DECLARATION + "<function" + SAMPLE_ROOT_ATTRIBUTES + ">\n" \
+        '<metadata type="function" msdnID="" beta="1">\n<tech value="stub"/>\n</metadata>\n' \
+        "<content>\n<desc><p>stub abstract</p></desc>\n<syntax>\n<params>\n" + stub_params + \
+        "</params>\n</syntax>\n<remarks><p>stub</p></remarks>\n</content>\n</function>\n"
+    orig = SAMPLE_DECLARATION + "<function" + SAMPLE_ROOT_ATTRIBUTES + ">\n" \
+        '<metadata type="function" msdnID="ff556000">\n<tech value="kernel"/>\n</metadata>\n' \
+        "<content>\n<desc><p><abstract>The sample routine.</abstract></p></desc>\n<syntax>\n" \
+        "<params>\n" + orig_params + "</params>\n<retval><p>STATUS_SUCCESS</p></retval>\n" \
+        "</syntax>\n<remarks>\n" + remarks + "</remarks>\n<info><p>info</p></info>\n" \
+        "<seealso><p>see also</p></seealso>\n</content>\n</function>\n"
+    htm = "<html><body><h1>sample</h1>\n<h2>Parameters</h2>\n<dl>\n" + \
+        "".join("<dt><i>" + name + "</i> [in]</dt>\n<dd>\n<p>Describes " + name + ".</p>\n</dd>\n"
+                for name in names) + "</dl>\n<h2>Return value</h2>\n</body></html>\n"
+    paths = []
+    for name, content in (("sample.htm", htm), ("sample_stub.xml", stub), ("sample_orig.xml", orig)):
+        paths.append(os.path.join(folder, name))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            f.write(content)
+    return tuple(paths)
+
+
+def benchmark_fill_xml(htm_file, xml_stub, original_xml, repeat=20):
+    """times fill_xml on a single stub, original and htm triple"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        xml_correction.fill_xml(htm_file, xml_stub, original_xml)
+    elapsed = (time.perf_counter() - start) / repeat
+    print("fill_xml : ", round(elapsed * 1000, 3), "ms per file")
+
+
+# the lookups fill_xml makes on the original tree
+ORIG_LOOKUPS = ("remarks", "seealso", "info", "retval")
+
+
+def benchmark_lookups(original_xml, repeat=20):
+    """times the lookups fill_xml makes on an original document, walking a plain
+    ElementTree against an IndexedTree. each run starts from a fresh tree"""
+    xml_bytes = xml_correction.preprocess_xml(original_xml)
+    for tree_type in (ET.ElementTree, xml_correction.IndexedTree):
+        elapsed = 0
+        for _ in range(repeat):
+            tree = tree_type(ET.fromstring(xml_bytes))
+            start = time.perf_counter()
+            xml_correction.get_param_term(tree)
+            for tag in ORIG_LOOKUPS:
+                xml_correction.find_node(tag, tree)
+            elapsed += time.perf_counter() - start
+        print(tree_type.__name__, "lookups : ", round(elapsed / repeat * 1000, 3), "ms per file")
+
+
+# the folder of this file, which holds the manifests the corpus is made from
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# the param section of a page, by the page type in its .md file
+CORPUS_PARAM_TERMS = {"struct": "members", "enum": "constants"}
+# the stages run_suite times, in the order they run for a document
+SUITE_STAGES = ("preprocess_xml", "extract_params_from_htm", "fill_xml", "write_tree",
+                "rewrite_header")
+
+
+def get_corpus_manifests():
+    """the manifests a corpus is made from by default"""
+    return sorted(glob.glob(os.path.join(PACKAGE_DIR, "type_mismatch_*.csv"))) + \
+        [os.path.join(PACKAGE_DIR, "Header_Mismatch_Data_3.csv")]
+
+
+def get_copy_info(conversion_info, copy):
+    """the conversion info of a copy of a manifest row, renamed so that its
+    files don't clash with the row's or with other copies. copy 0 is the row"""
+    if copy == 0:
+        return dict(conversion_info)
+    suffix = "_c" + str(copy)
+    copy_info = dict(conversion_info)
+    copy_info["title"] += suffix
+    copy_info["htm_location"] = copy_info["htm_location"].replace(".htm", suffix + ".htm")
+    copy_info["md_location"] = copy_info["md_location"].replace(".md", suffix + ".md")
+    return copy_info
+
+
+def get_corpus_topic(record, title, rng):
+    """makes the stub xml, original xml and htm page of a manifest record, in the
+    shape the conversion expects: the page type of the stub comes from the .md
+    file and that of the original from WDCML, and the original lists the WDCML
+    headers. returns (stub, orig, htm, param_term)"""
+    stub_type = record.type_in_md
+    orig_type = record.type_in_wdcml or stub_type
+    param_term = CORPUS_PARAM_TERMS.get(stub_type, "params")
+    param_tag = param_term[:-1]
+    names = ["Param" + str(i) for i in range(rng.randint(0, 8))]
+    stub_params = "".join("<" + param_tag + "><name>" + name + "</name><desc><p>stub</p></desc>"
+                          "</" + param_tag + ">\n" for name in names)
+    orig_params = stub_params.replace("<p>stub</p>", "<p>Describes the parameter.</p>")
+    retval = "<retval><p>Returns STATUS_SUCCESS — or an error code.</p></retval>\n" \
+        if stub_type != "ioctl" and rng.random() < 0.6 else ""
+    remarks = "".join("<p>Remark " + str(i) + " about <b>" + title + "</b>, see "
+                      '<xref rid="x' + str(i) + '">the café page</xref>.</p>\n'
+                      for i in range(rng.randint(1, 40)))
+    headers = [header for header in record.header_in_wdcml if header != "NONE"]
+    info = "<info>\n"
+    if headers:
+        info += "<header><filename>" + headers[0] + "</filename>\n" + \
+            "".join("<include_header><filename>" + header + "</filename></include_header>\n"
+                    for header in headers[1:]) + "</header>\n"
+    info += "<p>info</p>\n</info>\n"
+
+    stub = SAMPLE_DECLARATION + "<" + stub_type + SAMPLE_ROOT_ATTRIBUTES + ">\n" \
+        '<metadata type="' + stub_type + '" msdnID="" beta="1">\n<tech value="stub"/>\n' \
+        "</metadata>\n<content>\n<desc><p>stub abstract</p></desc>\n<syntax>\n" \
+        "<" + param_term + ">\n" + stub_params + "</" + param_term + ">\n</syntax>\n" \
+        "<remarks><p>stub</p></remarks>\n</content>\n</" + stub_type + ">\n"
+    orig = SAMPLE_DECLARATION + "<" + orig_type + SAMPLE_ROOT_ATTRIBUTES + ">\n" \
+        '<metadata type="' + orig_type + '" msdnID="ff' + str(rng.randint(100000, 999999)) + \
+        '">\n<tech value="kernel"/>\n</metadata>\n<content>\n' \
+        "<desc><p><abstract>The " + title + " " + stub_type + ".</abstract></p></desc>\n" \
+        "<syntax>\n<" + param_term + ">\n" + orig_params + "</" + param_term + ">\n" + \
+        retval + "</syntax>\n<remarks>\n" + remarks + "</remarks>\n" + info + \
+        "<seealso><p>see also</p></seealso>\n</content>\n</" + orig_type + ">\n"
+    heading = "Parameters" if param_term == "params" else param_term.capitalize()
+    htm = "<html><body><h1>" + title + "</h1>\n" + \
+        remarks.replace("xref", "a") + "<h2>" + heading + "</h2>\n<dl>\n" + \
+        "".join("<dt><i>" + name + "</i> [in]</dt>\n<dd>\n<p>Describes " + name + ".</p>\n</dd>\n"
+                for name in names) + "</dl>\n<h2>Return value</h2>\n<p>None</p>\n</body></html>\n"
+    return stub, orig, htm, param_term
+
+
+def generate_corpus(root, count, csv_locs=None, seed=1):
+    """writes count stub, original and htm triples under root, made from the rows
+    of the manifests in csv_locs, in the folders xml_correction expects: stubs in
+    root/stub, originals and built htm in root/sd. when there are more documents
+    than rows, the rows are used again under new names. returns a list of
+    (conversion_info, (orig, stub, htm), param_term, md_header), one per document"""
+    rng = random.Random(seed)
+    records = []
+    for csv_loc in csv_locs or get_corpus_manifests():
+        records.extend(manifest.read_manifest(csv_loc))
+    stub_loc = os.path.join(root, "stub")
+    sd_loc = os.path.join(root, "sd")
+    corpus = []
+    written = set()
+    for i in range(count):
+        record = records[i % len(records)]
+        # rows that repeat across manifests, or copies of them, get new names
+        copy = i // len(records)
+        while True:
+            conversion_info = get_copy_info(xml_correction.get_conversion_info(record), copy)
+            paths = xml_correction.get_filepaths(conversion_info, stub_loc, sd_loc, build=False)
+            if written.isdisjoint(paths):
+                break
+            copy += 1
+        written.update(paths)
+        stub, orig, htm, param_term = get_corpus_topic(record, conversion_info["title"], rng)
+        for path, content in zip(paths, (orig, stub, htm)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+        corpus.append((conversion_info, paths, param_term, record.header_in_md))
+    return corpus
+
+
+def get_stage_stats(times):
+    """count, total and distribution of a stage's times, in milliseconds"""
+    times = sorted(times)
+    count = len(times)
+    return {
+        "count": count,
+        "total_ms": round(sum(times) * 1000, 3),
+        "mean_ms": round(sum(times) / count * 1000, 4),
+        "median_ms": round(times[count // 2] * 1000, 4),
+        "p95_ms": round(times[min(count - 1, int(count * 0.95))] * 1000, 4),
+        "max_ms": round(times[-1] * 1000, 4),
+    }
+
+
+def get_commit():
+    """the commit of the checked out tree, or None outside a git repository"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=PACKAGE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(corpus, output_path, repeat=1, backend=None):
+    """times each stage of the conversion on every document of a corpus made by
+    generate_corpus, repeat times, with the xml_backend named by backend.
+    write_tree always writes a new file. returns the report: the run's details
+    under "meta", and each stage's stats"""
+    backend = xml_backend.get_backend(backend).name
+    os.makedirs(output_path, exist_ok=True)
+    times = {stage: [] for stage in SUITE_STAGES}
+    for _ in range(repeat):
+        for conversion_info, (orig, stub, htm), param_term, md_header in corpus:
+            start = time.perf_counter()
+            xml_correction.preprocess_xml(stub)
+            xml_correction.preprocess_xml(orig)
+            times["preprocess_xml"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            xml_correction.extract_params_from_htm(htm, param_term)
+            times["extract_params_from_htm"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            tree = xml_correction.fill_xml(htm, stub, orig, backend=backend)
+            times["fill_xml"].append(time.perf_counter() - start)
+
+            output_file = os.path.join(
+                output_path, xml_correction.get_output_filename(conversion_info["title"]))
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            start = time.perf_counter()
+            xml_correction.write_tree(tree, conversion_info["title"], output_path)
+            times["write_tree"].append(time.perf_counter() - start)
+
+            with open(orig, encoding="utf-8") as f:
+                content = f.read()
+            start = time.perf_counter()
+            header_rewrite.rewrite_header(content, md_header, conversion_info["title"])
+            times["rewrite_header"].append(time.perf_counter() - start)
+    return {
+        "meta": {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "documents": len(corpus),
+            "repeat": repeat,
+            "backend": backend,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": {stage: get_stage_stats(stage_times) for stage, stage_times in times.items()},
+    }
+
+
+def compare_reports(base, report):
+    """the ratio of each stage's mean time in report to its mean in base, for
+    the stages in both. above 1 is slower than base"""
+    ratios = {}
+    for stage, stats in report["stages"].items():
+        if stage in base["stages"]:
+            ratios[stage] = round(stats["mean_ms"] / base["stages"][stage]["mean_ms"], 3)
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmarks the xml correction pipeline")
+    parser.add_argument("xml_files", nargs="*", help="WDCML files to time preprocess_xml on")
+    parser.add_argument("--sample-sections", type=int, nargs="*", default=[],
+                        help="write sample topics with this many remarks sections to the working "
+                             "folder, and time fill_xml and its lookups on them")
+    parser.add_argument("--header-files", nargs="*", default=[],
+                        help="WDCML files to time the header rewrite on")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per file (default: 20)")
+    parser.add_argument("--corpus-size", type=int, default=0,
+                        help="generate a corpus of this many documents and time each stage of "
+                             "the conversion on it")
+    parser.add_argument("--corpus-dir", default="benchmark_corpus",
+                        help="the folder the corpus and its output are written to "
+                             "(default: benchmark_corpus)")
+    parser.add_argument("--corpus-csv", nargs="*", default=None,
+                        help="manifests to make the corpus from (default: type_mismatch_*.csv "
+                             "and Header_Mismatch_Data_3.csv)")
+    parser.add_argument("--suite-repeat", type=int, default=1,
+                        help="runs over the corpus (default: 1)")
+    parser.add_argument("--report", default="benchmark_report.json",
+                        help="the json file the corpus timings are written to "
+                             "(default: benchmark_report.json)")
+    parser.add_argument("--compare", help="a report from an earlier run to compare against")
+    parser.add_argument("--xml-backend", choices=sorted(xml_backend.BACKENDS),
+                        help="the xml backend the corpus is converted with "
+                             "(default: lxml, if it's installed)")
+    args = parser.parse_args()
+    for xml_file in args.xml_files:
+        print(xml_file)
+        benchmark_preprocess(xml_file, args.repeat)
+    for xml_file in args.header_files:
+        print(xml_file)
+        with open(xml_file) as f:
+            benchmark_rewrite_header(f.read(), args.repeat)
+    for sections in args.sample_sections:
+        folder = "sample_" + str(sections)
+        os.makedirs(folder, exist_ok=True)
+        htm_file, xml_stub, original_xml = write_sample_topic(folder, sections)
+        print(original_xml)
+        benchmark_fill_xml(htm_file, xml_stub, original_xml, args.repeat)
+        benchmark_lookups(original_xml, args.repeat)
+    if args.corpus_size:
+        corpus = generate_corpus(args.corpus_dir, args.corpus_size, args.corpus_csv)
+        report = run_suite(corpus, os.path.join(args.corpus_dir, "output"), args.suite_repeat,
+                           args.xml_backend)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        for stage, stats in report["stages"].items():
+            print(stage, ": ", stats["mean_ms"], "ms mean, ", stats["p95_ms"], "ms p95")
+        if args.compare:
+            with open(args.compare) as f:
+                base = json.load(f)
+            for stage, ratio in compare_reports(base, report).items():
+                print(stage, ": ", ratio, "x of", base["meta"]["commit"])
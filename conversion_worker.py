@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+converts files and fixes headers as they're asked for, for tools that send a
+few files at a time. a Converter keeps what's slow to set up between requests:
+the xml backend, and the path index of the depot and stubs. run as a script,
+it reads jobs as json objects, one per line, from stdin or a unix socket, and
+writes a json result line back as each job finishes
+
+a conversion job is {"type": "convert", "row": {...}}, where the row has the
+title, project, htm_location, md_location and owner of a manifest row, and can
+have an "output_dir" to write the file under. a header job is {"type": "header",
+"project": ..., "xml_location": ..., "header": ..., "title": ...}, with
+"dry_run": true to get a diff back instead of writing the file. any job can
+have an "id", which is sent back with its result
+
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+
+import header_mismatch
+import header_rewrite
+import input_cache
+import instrumentation
+import path_index
+import schema_validation
+import source_control
+import xml_backend
+import xml_correction
+
+
+class Converter:
+    """converts rows and fixes headers for a depot, keeping its path index, and
+    the trees and params of the inputs it's seen, between calls. calls from several threads are made one at a time"""
+
+    def __init__(self, stub_loc, sd_loc, backend=None, stream_size=xml_correction.ORIG_STREAM_SIZE,
+                 checkout_backend=header_mismatch.CHECKOUT_BACKEND, schema_loc=None,
+                 cache_size=input_cache.CACHE_SIZE, cache_dir=None):
+        self.stub_loc = stub_loc
+        self.sd_loc = sd_loc
+        # an unknown backend fails here, not on every job
+        self.backend = xml_backend.get_backend(backend).name
+        self.stream_size = stream_size
+        self.checkout_backend = checkout_backend
+        self.index = path_index.PathIndex([stub_loc, sd_loc])
+        # converted files are validated against this schema, if it's given
+        self.schema_loc = schema_loc
+        if schema_loc is not None:
+            schema_validation.get_schema(schema_loc)
+        # the trees and params of inputs seen by earlier jobs
+        self.cache = input_cache.InputCache(cache_size, cache_dir) if cache_size > 0 else None
+        self._lock = threading.Lock()
+
+    def get_missing_input(self, conversion_info):
+        """the error for a row's first missing input file, or None. files can be
+        added while the converter runs, so a folder is listed again before a file
+        in it is reported missing"""
+        missing = xml_correction.get_missing_input(conversion_info, self.stub_loc, self.sd_loc,
+                                                   self.index)
+        if missing is not None:
+            self.index.forget(os.path.dirname(missing.filename))
+            missing = xml_correction.get_missing_input(conversion_info, self.stub_loc,
+                                                       self.sd_loc, self.index)
+        return missing
+
+    def convert(self, conversion_info, trace=None):
+        """converts a row, and returns what xml_correction.convert_row does. the
+        project's html isn't built, so it has to have been built already"""
+        with self._lock:
+            if trace is None:
+                trace = instrumentation.RowTrace(conversion_info["title"])
+            with trace.stage("check_inputs"):
+                missing = self.get_missing_input(conversion_info)
+            if missing is not None:
+                failure = (threading.current_thread().name, xml_correction.describe_error(missing))
+                return xml_correction.build_failed(conversion_info, trace, failure,
+                                                   instrumentation.get_error_info(missing))
+            paths = xml_correction.get_filepaths(conversion_info, self.stub_loc, self.sd_loc,
+                                                 build=False, index=self.index)
+            return xml_correction.convert_row(conversion_info, self.stub_loc, self.sd_loc,
+                                              build=False, trace=trace, backend=self.backend,
+                                              stream_size=self.stream_size, paths=paths,
+                                              schema_loc=self.schema_loc, cache=self.cache)
+
+    def write(self, conversion_info, xml_bytes, base_output_dir):
+        """writes a converted row under base_output_dir, in its owner and project
+        folder, like main does. returns the path, and whether it was written,
+        which it isn't if the file there is the same"""
+        out = xml_correction.get_output_dir(conversion_info, base_output_dir)
+        os.makedirs(out, exist_ok=True)
+        written = xml_correction.write_serialized(xml_bytes, conversion_info["title"], out)
+        return os.path.join(out, xml_correction.get_output_filename(conversion_info["title"])), written
+
+    def fix_header(self, project, xml_location, md_headers, title="", dry_run=False):
+        """gives a project's WDCML file md_headers as its header. returns the
+        file's path, whether its content changed, and its diff if dry_run is
+        True, in which case the file isn't checked out or written. raises
+        OSError if it couldn't be checked out"""
+        with self._lock:
+            file_loc = header_mismatch.get_file_loc(project, xml_location, self.sd_loc)
+            content, new_content = header_mismatch.fix_header_file(file_loc, md_headers, title)
+            if dry_run:
+                return file_loc, new_content != content, \
+                    header_rewrite.get_diff(file_loc, content, new_content)
+            if new_content != content:
+                edits = [(file_loc, xml_location, content, new_content)]
+                _, errors = header_mismatch.write_edits(edits, self.sd_loc, self.checkout_backend)
+                if errors:
+                    raise OSError("could not check out " + file_loc)
+            return file_loc, new_content != content, None
+
+
+def run_job(converter, job):
+    """runs a job, a dict like the json jobs described above, and returns its
+    result as a json-able dict"""
+    result = {"id": job.get("id"), "type": job.get("type")}
+    try:
+        if job.get("type") == "convert":
+            conversion_info, xml_bytes, failure, trace = converter.convert(job["row"])
+            result.update(ok=failure is None, title=conversion_info["title"], error=trace.error)
+            if failure is None:
+                if job.get("output_dir"):
+                    result["output"], result["written"] = converter.write(
+                        conversion_info, xml_bytes, job["output_dir"])
+                else:
+                    result["xml"] = xml_bytes.decode("ascii")
+            result["trace"] = trace.to_dict()
+        elif job.get("type") == "header":
+            file_loc, changed, diff = converter.fix_header(
+                job["project"], job["xml_location"], job["header"], job.get("title", ""),
+                job.get("dry_run", False))
+            result.update(ok=True, file=file_loc, changed=changed)
+            if diff is not None:
+                result["diff"] = diff
+        else:
+            raise ValueError("unknown job type: " + str(job.get("type")))
+    except Exception as err:
+        result.update(ok=False, error=instrumentation.get_error_info(err))
+    return result
+
+
+def serve_lines(converter, infile, outfile):
+    """runs the json jobs read from infile a line at a time, until it ends,
+    and writes each result to outfile as a json line as soon as it's done"""
+    for line in infile:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("a job must be a json object")
+        except ValueError as err:
+            result = {"id": None, "ok": False, "error": instrumentation.get_error_info(err)}
+        else:
+            result = run_job(converter, job)
+        outfile.write(json.dumps(result) + "\n")
+        outfile.flush()
+
+
+class SocketLines:
+    """writes the text lines serve_lines writes to a socket's file"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode("utf-8"))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def serve_socket(converter, socket_path):
+    """serves jobs on a unix socket until it's interrupted. each connection
+    sends json lines of jobs, and gets their results back on the same
+    connection. connections are served at the same time, but their jobs are
+    run one at a time"""
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise OSError("unix sockets aren't supported here; use stdin")
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            infile = (line.decode("utf-8") for line in self.rfile)
+            outfile = SocketLines(self.wfile)
+            serve_lines(converter, infile, outfile)
+
+    if os.path.exists(socket_path):
+        # left behind by a worker that was killed
+        os.remove(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, JobHandler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="converts files and fixes headers for json jobs, read a line at a time")
+    parser.add_argument("--socket",
+                        help="serve jobs on this unix socket, instead of reading them from stdin")
+    parser.add_argument("--stub-loc", default=xml_correction.stub_loc,
+                        help="the stub location (default: " + xml_correction.stub_loc + ")")
+    parser.add_argument("--sd-loc", default=xml_correction.sd_loc,
+                        help="the source depot location (default: " + xml_correction.sd_loc + ")")
+    parser.add_argument("--xml-backend", choices=sorted(xml_backend.BACKENDS),
+                        help="parse and write the xml with lxml or xml.etree "
+                             "(default: lxml, if it's installed)")
+    parser.add_argument("--stream-size", type=int, default=xml_correction.ORIG_STREAM_SIZE,
+                        help="parse original documents larger than this many bytes a piece at "
+                             "a time (default: " + str(xml_correction.ORIG_STREAM_SIZE) + ")")
+    parser.add_argument("--checkout", choices=sorted(source_control.CHECKOUT_BACKENDS),
+                        default=header_mismatch.CHECKOUT_BACKEND,
+                        help="how header files are checked out before they're written "
+                             "(default: " + header_mismatch.CHECKOUT_BACKEND + ")")
+    parser.add_argument("--schema",
+                        help="validate converted files against this wdcml.xsd. needs lxml")
+    parser.add_argument("--cache-size", type=int, default=input_cache.CACHE_SIZE,
+                        help="bytes of parsed trees and scraped params to keep for inputs "
+                             "seen again; 0 turns the cache off "
+                             "(default: " + str(input_cache.CACHE_SIZE) + ")")
+    parser.add_argument("--cache-dir",
+                        help="also keep the preprocessed xml and scraped params in this folder")
+    args = parser.parse_args()
+    converter = Converter(args.stub_loc, args.sd_loc, args.xml_backend, args.stream_size,
+                          args.checkout, args.schema, args.cache_size, args.cache_dir)
+    # conversion progress is printed to stdout, which carries the results
+    results = sys.stdout
+    sys.stdout = sys.stderr
+    if args.socket:
+        serve_socket(converter, args.socket)
+    else:
+        serve_lines(converter, sys.stdin, results)
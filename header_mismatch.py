@@ -1,122 +1,109 @@
 import os
-import re
-import subprocess
+import header_rewrite
+import manifest
+import source_control
 """
-iterates through a CSV file containing header mismatch information, and inject the correct 
-header xml to a WDCML file
+iterates through a CSV file containing header mismatch information, and inject the correct
+header xml to a WDCML file. run it as a script, or import it and call main(), or
+fix_header_file() for a single file
 """
-# constants for the location to the header mismatch csv, 
+# constants for the location to the header mismatch csv,
 # and SourceDepot location, respectively. edit these for your system
 
-#NOTE: this script is setup to process a csv containing 
+#NOTE: this script is setup to process a csv containing
 #       only header mismatches, with a pipe char ("|") as a delimiter
 
 CSV_LOC = "C:\\Users\\aahi\\projects\\migration\\header_mismatch\\Header_Mismatch_Data_3.csv"
 SD_LOC = "C:\\Users\\aahi\\Sd"
+# how files are checked out before they're written: "sd", or "git" or "none"
+# to stand in for it when testing. see source_control.CHECKOUT_BACKENDS
+CHECKOUT_BACKEND = "sd"
+# if DRY_RUN is True, nothing is checked out or written. a unified diff of
+# every change is written to DIFF_LOC instead, for review
+DRY_RUN = False
+DIFF_LOC = "header_mismatch.diff"
 
-file_info =[]
-lines = []
-errors = []
-processed = []
-num_processed = 0
+def needs_header(record):
+    """checks whether a manifest record's file is processed
+    NOTE: <ovw> WDCML types cannot have <header> tags, and so must be skipped.
+    NOTE: refpages have dissimilar syntax, and are currently skipped"""
+    filetype = record.type_in_wdcml # the WDCML topic type
+    subtype = record.subtype_in_wdcml # the WDCML subtopic type
+    return filetype != "ovw" and subtype != "ovw" and filetype != "refpage"
 
-#open the csv file containing the header_mismatch information, and append the split lines to a list
-with open(CSV_LOC, "r") as f:
-    header = True # skip over the header line in the csv
-    for line in f:
-        if header:
-            header = False
-        else:
-            lines.append(line.split("|"))
+def get_file_loc(project, xml_loc, sd_loc=SD_LOC):
+    """the WDCML file of a project's topic, from the topic's xml location"""
+    return os.path.join(sd_loc, project, xml_loc.replace(".htm",".xml"))
 
+def fix_header_file(file_loc, md_headers, filename=""):
+    """reads a WDCML file, and returns its content, and its content with
+    md_headers as its header. raises ValueError if it has nowhere to put
+    the header, see header_rewrite.rewrite_header"""
+    with open(file_loc, "r") as xml_file:
+        content = xml_file.read() # read in file
+    # replace the header, and the include headers
+    return content, header_rewrite.rewrite_header(content, md_headers, filename)
 
-for line in lines:
-    #variables located in the csv lines
-    filename = line[0] # the "name" of the API
-    md_headers = line[1] # the header(s) listed in the API's .md file
-    wdcml_headers = line[2] # the headers listed in the API's WDCML file
-    project = line[5] # the project
-    filetype = line[7] # the WDCML topic type
-    subtype = line[8] # the WDCML subtopic type
-    xml_loc = line[13] # the location of the xml (WDCML) file
+def get_edits(csv_loc=CSV_LOC, sd_loc=SD_LOC):
+    """the (file_loc, xml_loc, content, new content) of each file a header
+    mismatch csv lists that's processed"""
+    edits = []
+    #read the csv file containing the header_mismatch information a line at a time
+    for record in manifest.read_manifest(csv_loc):
+        # conditions for processing a file as listed in the CSV
+        if needs_header(record):
+            xml_loc = record.xml_location # the location of the xml (WDCML) file
+            file_loc = get_file_loc(record.project, xml_loc, sd_loc)
+            # record.title is the "name" of the API, and header_in_md the
+            # header(s) listed in the API's .md file
+            content, new_content = fix_header_file(file_loc, record.header_in_md, record.title)
+            edits.append((file_loc, xml_loc, content, new_content))
+    return edits
 
-    # conditions for processing a file as listed in the CSV
-    # NOTE: <ovw> WDCML types cannot have <header> tags, and so must be skipped.
-    # NOTE: refpages have dissimilar syntax, and are currently skipped
-    if filetype != "ovw" and subtype != "ovw" and filetype != "refpage":
-
-        file_loc = os.path.join(SD_LOC, project, xml_loc.replace(".htm",".xml"))
-        content = "" # blank variable to store xml content
-        with open(file_loc, "r") as xml_file:
-            content = xml_file.read() # read in file
-            # use regex to find the header in the xml
-            # and get the specific header name
-            header = re.search(r"\<header\>\s*<filename>([\w\.]+)\s*</filename>",content)
-            if header:
-                header = header.group(1)
-            # regex to find the include headers
-            include_headers= re.findall(r"<include_header>\s*<filename>([\w\.]+)\s*</filename>\s*</include_header", content)
-            #list containing all unique header names to remove duplicates from the content
-            new_include = []
-            for h in include_headers:
-                #create list with normalized header names already captured from the file. 
-                #this list is compared against the current header name to determine if it's a duplicate. 
-                #if not, add it ot the list of unique header names
-                if h.lower() not in [x.lower() for x in new_include]:
-                    new_include.append(h)
-            #add the main header to become a <include_header> if it isn't already; the header specified in the .md file
-            #  will be the <header>
-            if header and header.lower() not in [x.lower() for x in new_include]:
-                new_include.append(header)
-            # create new header xml tag to replace the old one
-            new_header = "<header><filename>"+ md_headers + "</filename>\n"
-            if "</header>" not in content:
-                new_header += "</header>"
-            # start building a string of <include_header> tags
-            new_include_str = ""
-            for include in new_include:
-                new_include_str += "<include_header><filename>"+include+"</filename></include_header>\n"
-
-            # replace header tag with the new header xml line, if it exists
-            if header is not None:
-                content = re.sub(r"\<header\>\s*<filename>.+?</filename>", new_header, content)
-            # if a <header> tag does not exist, try searching for <info> or </info> to fill out. If not,
-            # the script will fail, and it must either be programmed to be created, or manually inserted.
-            else:
-                try:
-                    assert "<info>" in content
-                    content = re.sub("<info>", "<info>\n"+new_header+"\n", content)
-                except AssertionError:
-                    assert "<info/>" in content, filename+" does not have an info tag"
-                    content = re.sub("<info/>", "<info>\n"+new_header+"\n</info>", content)
-            # replace header_include (or insert if necesary)
-            if new_include:
-                if "<include_header>" in content:
-                    content = re.sub(r"<include_header>.+</include_header>", new_include_str, content)
-                else:
-                    content = re.sub(r"</header>",new_include_str+"\n"+"</header>", content)
-
-        # automatically checkout the file from source depot, so it can be edited.
-        # if the file is checked out or out of sync, an authorization exception will be raised 
-        powershell = "C:\\WINDOWS\\system32\\WindowsPowerShell\\v1.0\\powershell.exe "
-        command = "sd edit " + file_loc
-        # NOTE: set the execution policy to allow the script to be run
-        call = [powershell, '-ExecutionPolicy', 'Unrestricted', " & ", command]
-        # NOTE change the working directory to the project path before execution
-        return_code = subprocess.call(call, cwd=SD_LOC)
+def write_edits(edits, sd_loc=SD_LOC, checkout_backend=CHECKOUT_BACKEND):
+    """checks out and writes the new content of edits, as get_edits returns them.
+    returns the xml locations of the files written, and the paths of the files
+    that couldn't be checked out, which are left unwritten"""
+    processed = []
+    errors = []
+    # automatically checkout the files from source depot, so they can be edited.
+    # files that are checked out or out of sync fail, and are left unwritten
+    failed_checkouts = set(source_control.checkout_files(
+        [file_loc for file_loc, _, _, _ in edits], sd_loc, checkout_backend))
+    for file_loc, xml_loc, _, content in edits:
+        if file_loc in failed_checkouts:
+            errors.append(file_loc)
+            continue
         # store the processed file for output later
         processed.append(os.path.join(xml_loc.replace(".htm",".xml")))
         # write the edited topic content to the file
         with open(file_loc, "w") as f_write:
             f_write.write(content)
-            #update the count of processed files
-            num_processed += 1
-            
-#print the processed files
-print("files (", num_processed, ") processed:")
-for p in processed:
-    print (p)
-#print(num_processed, " files successfully fixed")
-#print("\nthe following files could not be written:")
-#for f in errors:
-#    print(f)
+    return processed, errors
+
+def main(csv_loc=CSV_LOC, sd_loc=SD_LOC, checkout_backend=CHECKOUT_BACKEND, dry_run=DRY_RUN,
+         diff_loc=DIFF_LOC):
+    """fixes the headers of the files a header mismatch csv lists. if dry_run
+    is True, a diff of the changes is written to diff_loc instead"""
+    edits = get_edits(csv_loc, sd_loc)
+    if dry_run:
+        with open(diff_loc, "w") as f:
+            f.write("".join(header_rewrite.get_diff(file_loc, content, new_content)
+                            for file_loc, _, content, new_content in edits))
+        print("dry run: diffs of", len(edits), "files written to", diff_loc)
+        edits = []
+
+    processed, errors = write_edits(edits, sd_loc, checkout_backend)
+    #print the processed files
+    print("files (", len(processed), ") processed:")
+    for p in processed:
+        print (p)
+    #print(num_processed, " files successfully fixed")
+    if errors:
+        print("\nthe following files could not be checked out, and were not written:")
+        for f in errors:
+            print(f)
+    return processed, errors
+
+if __name__ == "__main__":
+    main()
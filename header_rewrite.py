@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+rewrites the <header> and <include_header> tags of a WDCML file, so the header
+listed in the API's .md file becomes the <header>, and the headers the file
+listed before become <include_header> tags
+
+"""
+
+import difflib
+import re
+
+# the header and the include headers a file lists
+HEADER_NAME_REGEX = re.compile(r"\<header\>\s*<filename>([\w\.]+)\s*</filename>")
+INCLUDE_NAME_REGEX = re.compile(
+    r"<include_header>\s*<filename>([\w\.]+)\s*</filename>\s*</include_header")
+
+# the old header's filename, which the new header replaces
+HEADER_REGEX = re.compile(r"\<header\>\s*<filename>.+?</filename>")
+# the include headers on a line, which the new include headers replace
+INCLUDE_REGEX = re.compile(r"<include_header>.+</include_header>")
+
+def literal(replacement):
+    """escapes a replacement string for re.sub, so it's used as it is"""
+    return replacement.replace("\\", "\\\\")
+
+def get_include_headers(content):
+    """gets the header a file lists, or None, and the unique headers that should be
+    its include headers: the ones it includes, then the header it lists. case is
+    ignored when looking for duplicates, and the first spelling is kept"""
+    header = HEADER_NAME_REGEX.search(content)
+    if header:
+        header = header.group(1)
+    new_include = []
+    seen = set()
+    for include in INCLUDE_NAME_REGEX.findall(content):
+        if include.lower() not in seen:
+            seen.add(include.lower())
+            new_include.append(include)
+    #add the main header to become a <include_header> if it isn't already; the header specified in the .md file
+    #  will be the <header>
+    if header and header.lower() not in seen:
+        new_include.append(header)
+    return header, new_include
+
+def rewrite_header(content, md_headers, filename=""):
+    """returns the content of a WDCML file with md_headers as its <header>, and the
+    headers it listed before as its <include_header> tags. raises ValueError if the
+    file has no <header>, <info> or <info/> tag to put the header in. filename is
+    only used in that error"""
+    header, new_include = get_include_headers(content)
+    # create new header xml tag to replace the old one
+    new_header = "<header><filename>"+ md_headers + "</filename>\n"
+    if "</header>" not in content:
+        new_header += "</header>"
+    # start building a string of <include_header> tags
+    new_include_str = "".join("<include_header><filename>" + include +
+                              "</filename></include_header>\n" for include in new_include)
+
+    # replace header tag with the new header xml line, if it exists
+    if header is not None:
+        content = HEADER_REGEX.sub(literal(new_header), content)
+    # if a <header> tag does not exist, try searching for <info> or </info> to fill out
+    elif "<info>" in content:
+        content = content.replace("<info>", "<info>\n" + new_header + "\n")
+    elif "<info/>" in content:
+        content = content.replace("<info/>", "<info>\n" + new_header + "\n</info>")
+    else:
+        raise ValueError(filename + " does not have an info tag")
+    # replace header_include (or insert if necesary)
+    if new_include:
+        if "<include_header>" in content:
+            content = INCLUDE_REGEX.sub(literal(new_include_str), content)
+        else:
+            content = content.replace("</header>", new_include_str + "\n</header>")
+    return content
+
+def get_diff(file_loc, content, new_content):
+    """a unified diff of a file's content before and after it's rewritten"""
+    return "".join(difflib.unified_diff(content.splitlines(True), new_content.splitlines(True),
+                                        file_loc, file_loc))
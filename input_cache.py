@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+remembers what's made from a conversion's input files, by a hash of their
+content: the parsed stub and original trees, and the params scraped from htm
+files. rows share inputs, e.g. the three manifests repeat titles, so the same
+bytes aren't preprocessed, parsed and scraped again. the cache is held in
+memory up to a size, dropping what was used least recently, and can also keep
+what it makes in a folder, so a later run starts with it
+
+"""
+
+import collections
+import hashlib
+import json
+import os
+
+# the bytes the cache holds in memory by default
+CACHE_SIZE = 64 * 1024 * 1024
+# roughly the bytes a parsed tree takes for each byte of the xml it was parsed from
+TREE_SIZE_FACTOR = 6
+# the number of keys remembered as seen once, see InputCache.put
+SEEN_KEYS = 100000
+
+# the caches of this process, by their size and folder
+_shared = {}
+
+
+def get_digest(data):
+    """the content hash of bytes that a cache key is made with"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_shared_cache(max_bytes=CACHE_SIZE, cache_dir=None):
+    """the cache of this process with the given size and folder, made the first
+    time it's asked for. a cache sent to a worker process becomes that process's
+    cache with the same settings, so it lasts from one row to the next"""
+    settings = (max_bytes, cache_dir)
+    if settings not in _shared:
+        _shared[settings] = InputCache(max_bytes, cache_dir)
+    return _shared[settings]
+
+
+class InputCache:
+    """a cache of values made from input files, with the keys made of a kind,
+    like "stub" or "params", and the content hash of the file. hits, misses and
+    values found in the folder are counted by kind in stats, and on a trace's
+    counters if one is given. it isn't shared between threads"""
+
+    def __init__(self, max_bytes=CACHE_SIZE, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = collections.OrderedDict()
+        self._seen = collections.OrderedDict()
+        self.size = 0
+        self.stats = collections.Counter()
+
+    def __reduce__(self):
+        return get_shared_cache, (self.max_bytes, self.cache_dir)
+
+    def _count(self, name, kind, trace):
+        self.stats[name + "_" + kind] += 1
+        if trace is not None:
+            trace.count("cache_" + name + "_" + kind)
+
+    def get(self, kind, key, trace=None):
+        """the value cached for a key, or None. the value is the cached one,
+        which the caller copies before it's changed"""
+        entry = self._entries.get((kind,) + key)
+        if entry is None:
+            self._count("misses", kind, trace)
+            return None
+        self._entries.move_to_end((kind,) + key)
+        self._count("hits", kind, trace)
+        return entry[0]
+
+    def put(self, kind, key, value, size):
+        """caches a value, taking about size bytes, dropping the values used
+        least recently to make room. most inputs are only seen once, and a
+        value is only kept the second time it's put, so those never cost a copy.
+        returns whether it was kept. a value larger than the cache isn't"""
+        key = (kind,) + key
+        if key not in self._seen:
+            self._seen[key] = True
+            if len(self._seen) > SEEN_KEYS:
+                self._seen.popitem(last=False)
+            return False
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            return False
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, dropped_size) = self._entries.popitem(last=False)
+            self.size -= dropped_size
+            self.stats["evictions"] += 1
+        return key in self._entries
+
+    def _get_disk_path(self, kind, key):
+        name = get_digest(json.dumps([kind] + list(key)).encode("utf-8"))
+        return os.path.join(self.cache_dir, kind, name[:2], name)
+
+    def load(self, kind, key, trace=None):
+        """the bytes stored in the cache folder for a key, or None. always None
+        if there's no folder"""
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._get_disk_path(kind, key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._count("disk_hits", kind, trace)
+        return data
+
+    def store(self, kind, key, data):
+        """stores bytes in the cache folder for a key, if there's a folder. they're
+        written to a temporary file first, so a reader never sees part of them"""
+        if self.cache_dir is None:
+            return
+        path = self._get_disk_path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+def get_stats_summary(counters):
+    """a line for each kind in a run's cache counters, named like the ones
+    InputCache counts on traces, e.g. "stub: 10 hits, 5 misses, 2 from disk" """
+    kinds = collections.defaultdict(collections.Counter)
+    for name, amount in counters.items():
+        if name.startswith("cache_"):
+            stat, _, kind = name[len("cache_"):].rpartition("_")
+            kinds[kind][stat] += amount
+    return [kind + ": " + str(stats["hits"]) + " hits, " + str(stats["misses"]) + " misses, " +
+            str(stats["disk_hits"]) + " from disk" for kind, stats in sorted(kinds.items())]
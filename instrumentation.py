@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+records where the conversion of each row spends its time: a trace per row,
+with the time taken by each stage, counters for things like params that
+weren't found, and the error the row failed with. traces are written as
+json lines, and summarized at the end of a run
+
+"""
+
+import contextlib
+import json
+import os
+import time
+import traceback
+
+# the number of frames kept from the traceback of a failed row, innermost last
+TRACEBACK_FRAMES = 6
+# the number of rows and stages listed in a summary
+SUMMARY_SIZE = 10
+
+
+def get_traceback_summary(err, frames=TRACEBACK_FRAMES):
+    """the last frames of an exception's traceback, as "file:line in function" """
+    return [os.path.basename(frame.filename) + ":" + str(frame.lineno) + " in " + frame.name
+            for frame in traceback.extract_tb(err.__traceback__)[-frames:]]
+
+
+def get_error_info(err):
+    """the type, message and traceback summary of an exception, as a
+    picklable dict"""
+    return {
+        "type": type(err).__name__,
+        "message": str(err),
+        "traceback": get_traceback_summary(err),
+    }
+
+
+class RowTrace:
+    """the timings, counters and error of a single row's conversion. it's
+    picklable, so it can be filled in by a worker process and sent back"""
+
+    def __init__(self, title, position=None):
+        self.title = title
+        self.position = position
+        self.worker = None
+        self.stages = {}
+        self.counters = {}
+        self.error = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """times the code run in a with block as a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """adds seconds to a stage's time"""
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def count(self, name, amount=1):
+        """adds to one of the row's counters"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_error(self, worker, error_info):
+        """records the error the row failed with, from get_error_info"""
+        self.worker = worker
+        self.error = error_info
+
+    def total(self):
+        """the time of all the row's stages, in seconds"""
+        return sum(self.stages.values())
+
+    def to_dict(self):
+        """the trace as a json-able dict, with times in milliseconds"""
+        return {
+            "position": self.position,
+            "title": self.title,
+            "worker": self.worker,
+            "total_ms": round(self.total() * 1000, 3),
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "counters": self.counters,
+            "error": self.error,
+        }
+
+
+class TraceLog:
+    """writes the traces of a run to a json lines file as rows finish, and
+    keeps what's needed to summarize the run: the slowest rows, and the
+    total time and counters of each stage"""
+
+    def __init__(self, trace_file, summary_size=SUMMARY_SIZE):
+        self.trace_file = trace_file
+        self.summary_size = summary_size
+        self.rows = 0
+        self.failures = 0
+        self.stage_totals = {}
+        self.stage_max = {}
+        self.counters = {}
+        self.slowest = []
+        self._f = open(trace_file, "w")
+
+    def write(self, trace):
+        """records a finished row's trace"""
+        self._f.write(json.dumps(trace.to_dict()) + "\n")
+        self.rows += 1
+        if trace.error is not None:
+            self.failures += 1
+        for name, seconds in trace.stages.items():
+            self.stage_totals[name] = self.stage_totals.get(name, 0) + seconds
+            self.stage_max[name] = max(self.stage_max.get(name, 0), seconds)
+        for name, amount in trace.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + amount
+        # only the slowest rows are kept, so a large run's traces aren't held in memory
+        self.slowest.append((trace.total(), trace.title))
+        if len(self.slowest) > self.summary_size * 2:
+            self.slowest.sort(reverse=True)
+            del self.slowest[self.summary_size:]
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def summary(self):
+        """the run's row and failure counts, counters, the slowest rows, and
+        the stages by the total time spent in them, as a json-able dict"""
+        slowest = sorted(self.slowest, reverse=True)[:self.summary_size]
+        stages = sorted(self.stage_totals.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "rows": self.rows,
+            "failures": self.failures,
+            "counters": self.counters,
+            "slowest_rows": [{"title": title, "total_ms": round(seconds * 1000, 3)}
+                             for seconds, title in slowest],
+            "slowest_stages": [{"stage": name, "total_ms": round(seconds * 1000, 3),
+                                "max_ms": round(self.stage_max[name] * 1000, 3)}
+                               for name, seconds in stages[:self.summary_size]],
+        }
+
+    def write_summary(self, summary_file=None):
+        """writes the summary as json, by default next to the trace file"""
+        summary_file = summary_file or os.path.splitext(self.trace_file)[0] + "_summary.json"
+        with open(summary_file, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        return summary_file
+
+    def print_summary(self):
+        summary = self.summary()
+        print("traced", summary["rows"], "rows,", summary["failures"], "failed, to", self.trace_file)
+        for name, amount in sorted(summary["counters"].items()):
+            print("  ", name, ": ", amount)
+        print("slowest stages:")
+        for stage in summary["slowest_stages"]:
+            print("  ", stage["stage"], ": ", stage["total_ms"], "ms total,", stage["max_ms"], "ms max")
+        print("slowest rows:")
+        for row in summary["slowest_rows"]:
+            print("  ", row["title"], ": ", row["total_ms"], "ms")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+reads the mismatch manifests: the comma delimited type_mismatch_*.csv files,
+and the pipe delimited Header_Mismatch_Data_*.csv files. Both have the same
+header line, and list columns like ['Ntddk.h', 'Dbgeng.h']
+
+"""
+
+import collections
+import re
+
+# columns holding a python style list of strings
+LIST_COLUMNS = ("Header in WDCML", "Path in Kit")
+
+
+def get_field_name(column):
+    """the record attribute for a header column, e.g. "Header in MD" -> header_in_md"""
+    return re.sub(r"\W+", "_", column.strip()).strip("_").lower()
+
+
+def get_delimiter(header_line):
+    """the manifests with a pipe in the header line are pipe delimited"""
+    return "|" if "|" in header_line else ","
+
+
+def split_fields(line, delimiter):
+    """splits a manifest line on the delimiter, except inside brackets or
+    double quotes. quotes around a field are removed"""
+    if "[" not in line and '"' not in line:
+        return line.split(delimiter)
+    fields = []
+    open_field = False
+    for piece in line.split(delimiter):
+        if open_field:
+            fields[-1] += delimiter + piece
+        else:
+            fields.append(piece)
+        field = fields[-1]
+        open_field = field.count("[") > field.count("]") or \
+            (field.startswith('"') and field.count('"') % 2 == 1)
+    for i, field in enumerate(fields):
+        if len(field) > 1 and field[0] == '"' and field[-1] == '"':
+            fields[i] = field[1:-1].replace('""', '"')
+    return fields
+
+
+def parse_list(value):
+    """parses a list column to a tuple of strings. a blank column is an empty
+    tuple. items are usually quoted, with doubled backslashes, but some aren't,
+    like [NONE]"""
+    if not value:
+        return ()
+    if value[0] != "[" or value[-1] != "]":
+        raise ValueError("not a list: " + value)
+    items = []
+    for item in value[1:-1].split(","):
+        item = item.strip()
+        if len(item) > 1 and item[0] == item[-1] and item[0] in "'\"":
+            item = item[1:-1].replace("\\\\", "\\")
+        if item:
+            items.append(item)
+    return tuple(items)
+
+
+def read_manifest(csv_loc):
+    """yields a record for each row of a manifest, as it's read. records are
+    namedtuples with an attribute for each header column, named by get_field_name,
+    and the list columns are parsed to tuples"""
+    with open(csv_loc, "r") as f:
+        header_line = f.readline().rstrip("\r\n")
+        delimiter = get_delimiter(header_line)
+        columns = split_fields(header_line, delimiter)
+        record_type = collections.namedtuple("ManifestRecord", [get_field_name(c) for c in columns])
+        list_positions = [i for i, column in enumerate(columns) if column in LIST_COLUMNS]
+        for line_number, line in enumerate(f, 2):
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            fields = split_fields(line, delimiter)
+            if len(fields) != len(columns):
+                raise ValueError(csv_loc + ", line " + str(line_number) + ": expected " +
+                                 str(len(columns)) + " columns, found " + str(len(fields)))
+            try:
+                for i in list_positions:
+                    fields[i] = parse_list(fields[i])
+            except ValueError as err:
+                raise ValueError(csv_loc + ", line " + str(line_number) + ": " + str(err))
+            yield record_type._make(fields)
+
+
+def get_asset_key(record):
+    """the Asset ID a record is deduplicated by, ignoring case and spaces,
+    or None if it doesn't have one"""
+    return record.asset_id.strip().upper() or None
+
+
+def read_manifests(csv_locs, duplicates=None):
+    """yields the records of several manifests, in order, as they're read,
+    skipping the ones whose Asset ID an earlier record had. the manifests
+    share many rows. if duplicates is a list, the skipped records are added
+    to it"""
+    seen = set()
+    for csv_loc in csv_locs:
+        for record in read_manifest(csv_loc):
+            key = get_asset_key(record)
+            if key is not None and key in seen:
+                if duplicates is not None:
+                    duplicates.append(record)
+                continue
+            seen.add(key)
+            yield record
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+finds the input files of a conversion without a stat per file. each folder
+under the depot and stub locations is listed once, with os.scandir, the
+first time a path in it is looked up, and later lookups are dict lookups.
+names are matched ignoring case, so the windows cased paths in the manifests
+resolve on case sensitive mounts too
+
+"""
+
+import errno
+import os
+import threading
+
+
+class PathIndex:
+    """an index of the files under a few root folders. resolve() gives the
+    path a file actually has, or None if there's no such file. only the part
+    of a path under a root is matched ignoring case"""
+
+    def __init__(self, roots):
+        self.roots = [os.path.normpath(root) for root in roots]
+        # maps each folder that's been listed to its entries, by name and by
+        # lowercase name, or to None if it isn't a folder
+        self._folders = {}
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def _list_folder(self, folder):
+        with self._lock:
+            if folder in self._folders:
+                return self._folders[folder]
+        entries = None
+        try:
+            with os.scandir(folder) as it:
+                names = set()
+                lower_names = {}
+                for entry in it:
+                    names.add(entry.name)
+                    # when two names differ only in case, the first listed is used
+                    lower_names.setdefault(entry.name.lower(), entry.name)
+                entries = (names, lower_names)
+        except OSError:
+            pass
+        with self._lock:
+            self.scans += 1
+            self._folders[folder] = entries
+        return entries
+
+    def _get_root(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    def resolve(self, path):
+        """the path of the file at path, with the case it has on disk, or
+        None if it doesn't exist. paths outside the roots are checked with
+        os.path.exists"""
+        path = os.path.normpath(path)
+        root = self._get_root(path)
+        if root is None:
+            return path if os.path.exists(path) else None
+        resolved = root
+        parts = os.path.relpath(path, root).split(os.sep) if path != root else []
+        for part in parts:
+            entries = self._list_folder(resolved)
+            if entries is None:
+                return None
+            names, lower_names = entries
+            name = part if part in names else lower_names.get(part.lower())
+            if name is None:
+                return None
+            resolved = os.path.join(resolved, name)
+        return resolved
+
+    def forget(self, path):
+        """drops the listings of a folder that's changed, e.g. one a build has
+        written, along with those of the folders above and below it"""
+        path = os.path.normpath(path)
+        with self._lock:
+            for folder in list(self._folders):
+                if folder == path or folder.startswith(path.rstrip(os.sep) + os.sep) or \
+                        path.startswith(folder.rstrip(os.sep) + os.sep):
+                    del self._folders[folder]
+
+
+def get_missing_error(path):
+    """the error opening a missing file raises, without opening it"""
+    return FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
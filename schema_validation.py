@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+checks converted files against the WDCML schema, in memory, before they're
+written, so a file that won't open in XMetaL fails the conversion instead.
+the schema is compiled once per process and thread, and compiled again only
+if it changes. it needs lxml. run as a script, it checks files that have
+already been written, on several processes
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# where the schema is under the depot. files refer to it relative to their
+# project folder, as ../../BuildX/Schema/xsd/wdcml.xsd
+SCHEMA_PATH = os.path.join("BuildX", "Schema", "xsd", "wdcml.xsd")
+# the number of the validator's errors kept in a failure
+ERROR_LINES = 3
+
+# the schemas compiled by each thread. lxml's validators aren't shared
+# between threads
+_compiled = threading.local()
+
+
+class SchemaValidationError(ValueError):
+    """a document the schema doesn't accept. the message holds the
+    validator's first errors"""
+
+
+def get_schema_loc(sd_loc):
+    """the schema in a depot"""
+    return os.path.join(sd_loc, SCHEMA_PATH)
+
+
+def get_schema(schema_loc):
+    """the compiled schema at schema_loc. it's compiled the first time it's
+    used in a thread, and again if the file's size or modification time has
+    changed. raises ValueError if lxml isn't installed, OSError if the file
+    can't be read, and lxml's errors if it isn't a schema"""
+    if etree is None:
+        raise ValueError("schema validation needs lxml, which isn't installed")
+    stat = os.stat(schema_loc)
+    key = (stat.st_size, stat.st_mtime_ns)
+    schemas = getattr(_compiled, "schemas", None)
+    if schemas is None:
+        schemas = _compiled.schemas = {}
+    cached = schemas.get(schema_loc)
+    if cached is None or cached[0] != key:
+        # parsed from the path, so the files it includes are found next to it
+        cached = schemas[schema_loc] = (key, etree.XMLSchema(etree.parse(schema_loc)))
+    return cached[1]
+
+
+def get_errors(schema, limit=ERROR_LINES):
+    """the first errors of the schema's last validation, as one line"""
+    errors = ["line " + str(error.line) + ": " + error.message for error in schema.error_log]
+    if len(errors) > limit:
+        errors = errors[:limit] + ["and " + str(len(errors) - limit) + " more"]
+    return "; ".join(errors)
+
+
+def validate(xml_bytes, schema_loc):
+    """checks a serialized document against the schema at schema_loc. raises
+    SchemaValidationError if it isn't valid, or isn't well formed"""
+    schema = get_schema(schema_loc)
+    try:
+        document = etree.fromstring(xml_bytes)
+    except etree.XMLSyntaxError as err:
+        raise SchemaValidationError("not well formed: " + str(err))
+    if not schema.validate(document):
+        raise SchemaValidationError("not valid WDCML: " + get_errors(schema))
+
+
+def validate_file(path, schema_loc):
+    """checks a file against the schema. returns its path, and the error, or
+    None if it's valid"""
+    try:
+        with open(path, "rb") as f:
+            validate(f.read(), schema_loc)
+    except (OSError, SchemaValidationError) as err:
+        return path, type(err).__name__ + ": " + str(err)
+    return path, None
+
+
+def iter_xml_files(paths):
+    """the paths given, with the .xml files under any folders among them"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for folder, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.endswith(".xml"):
+                    yield os.path.join(folder, name)
+
+
+def validate_files(paths, schema_loc, workers=1):
+    """yields (path, error) for each of paths, in order, where error is None
+    if the file is valid. if workers is more than 1, the files are checked
+    on that many processes"""
+    # a missing schema or lxml fails here, not on every file
+    get_schema(schema_loc)
+    if workers <= 1:
+        for path in paths:
+            yield validate_file(path, schema_loc)
+        return
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield from pool.map(validate_file, paths, [schema_loc] * len(paths), chunksize=16)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="checks xml files against the WDCML schema")
+    parser.add_argument("paths", nargs="+", help="files, or folders of .xml files, to check")
+    parser.add_argument("--schema", required=True, help="the wdcml.xsd to check them against")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes to check files with (default: 1)")
+    args = parser.parse_args()
+    invalid = 0
+    checked = 0
+    for path, error in validate_files(list(iter_xml_files(args.paths)), args.schema, args.workers):
+        checked += 1
+        if error is not None:
+            invalid += 1
+            print(path + ": " + error)
+    print(checked, "files checked,", invalid, "invalid")
+    sys.exit(1 if invalid else 0)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+splits the conversion across build machines, and merges what they write.
+the rows of the manifests are deduplicated by Asset ID, and each project is
+given to a shard by a stable hash of its name, so a project's html is only
+built on one machine. each machine runs xml_correction.py with --shard in
+its own folder, and the merge combines their out folders and failed files,
+reporting any output file that two shards wrote differently
+
+"""
+
+import argparse
+import collections
+import hashlib
+import os
+import shutil
+import sys
+import zlib
+
+import manifest
+
+FAILED_FILES = "failed_files.txt"
+CONFLICTS_FILE = "merge_conflicts.txt"
+
+
+def get_shard(project, shards):
+    """the shard, from 0 to shards - 1, a project's rows go to. it's the same
+    on every machine and every run, and ignores the case of the project"""
+    return zlib.crc32(project.lower().encode("utf-8")) % shards
+
+
+def parse_shard(value):
+    """parses a shard given as "index/shards", e.g. "2/4", counting from 1.
+    returns (index, shards), with index counting from 0"""
+    try:
+        index, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError("a shard is given as index/shards, e.g. 2/4: " + value)
+    if not 1 <= index <= shards:
+        raise ValueError("shard index out of range: " + value)
+    return index - 1, shards
+
+
+def select_shard(records, index, shards):
+    """yields the manifest records of one shard"""
+    for record in records:
+        if get_shard(record.project, shards) == index:
+            yield record
+
+
+def plan_shards(csv_locs, shards):
+    """the projects and the number of deduplicated rows of each shard"""
+    plan = [collections.Counter() for _ in range(shards)]
+    for record in manifest.read_manifests(csv_locs):
+        plan[get_shard(record.project, shards)][record.project] += 1
+    return plan
+
+
+def read_failures(failed_files):
+    """the records of a failed files list, each a title line and the
+    lines after it, up to a blank line"""
+    with open(failed_files) as f:
+        return [record.strip("\n") + "\n" for record in f.read().split("\n\n") if record.strip()]
+
+
+def get_file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def merge_shards(shard_dirs, merged_dir):
+    """copies the out folder of each shard's folder into merged_dir/out, and
+    writes their failed files, in shard order, to merged_dir/failed_files.txt.
+    an output file two shards wrote with different content is a conflict:
+    the first shard's file is kept, and the conflict is written to
+    merged_dir/merge_conflicts.txt. returns the conflicts, as (output file,
+    the shard folders that wrote it)"""
+    merged_out = os.path.join(merged_dir, "out")
+    # maps each output file, by its normalized path under out, to its
+    # content hash and the shard folders that wrote it
+    outputs = {}
+    conflicts = {}
+    failures = []
+    for shard_dir in shard_dirs:
+        out = os.path.join(shard_dir, "out")
+        for folder, _, files in os.walk(out):
+            for name in sorted(files):
+                rel_path = os.path.relpath(os.path.join(folder, name), out)
+                key = os.path.normcase(rel_path)
+                file_hash = get_file_hash(os.path.join(folder, name))
+                if key in outputs:
+                    first_hash, writers = outputs[key]
+                    writers.append(shard_dir)
+                    if file_hash != first_hash:
+                        conflicts[key] = (rel_path, writers)
+                    continue
+                outputs[key] = (file_hash, [shard_dir])
+                target = os.path.join(merged_out, rel_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(os.path.join(folder, name), target)
+        failed_files = os.path.join(shard_dir, FAILED_FILES)
+        if os.path.exists(failed_files):
+            failures.extend(read_failures(failed_files))
+    with open(os.path.join(merged_dir, FAILED_FILES), "w") as f:
+        f.write("".join(failure + "\n" for failure in failures))
+    conflicts = sorted(conflicts.values())
+    with open(os.path.join(merged_dir, CONFLICTS_FILE), "w") as f:
+        for rel_path, writers in conflicts:
+            f.write(rel_path + ": written differently by " + ", ".join(writers) + "\n")
+    return conflicts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="plans shards of the conversion, and merges "
+                                                 "the output of the shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan_parser = commands.add_parser("plan", help="list the projects and rows of each shard")
+    plan_parser.add_argument("shards", type=int, help="number of shards")
+    plan_parser.add_argument("manifests", nargs="+", help="the manifests to split")
+    merge_parser = commands.add_parser("merge", help="merge the output of shards")
+    merge_parser.add_argument("merged_dir", help="folder to write the merged output to")
+    merge_parser.add_argument("shard_dirs", nargs="+",
+                              help="the folders the shards were run in, in order")
+    args = parser.parse_args()
+    if args.command == "plan":
+        for index, projects in enumerate(plan_shards(args.manifests, args.shards)):
+            print("shard " + str(index + 1) + "/" + str(args.shards) + ": " +
+                  str(sum(projects.values())) + " rows")
+            for project, rows in sorted(projects.items()):
+                print("  ", project, ": ", rows)
+    else:
+        conflicts = merge_shards(args.shard_dirs, args.merged_dir)
+        for rel_path, writers in conflicts:
+            print("!!conflict!!", rel_path, "written differently by", ", ".join(writers))
+        sys.exit(1 if conflicts else 0)
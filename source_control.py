@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+checks files out of source control before they're edited, a chunk of
+files per command instead of a command per file
+
+"""
+
+import subprocess
+
+POWERSHELL = "C:\\WINDOWS\\system32\\WindowsPowerShell\\v1.0\\powershell.exe "
+# the longest command line a chunk of paths can make. windows allows 32767
+# characters, and this leaves room for the command and powershell itself
+COMMAND_LINE_LIMIT = 8000
+
+
+def quote_powershell(path):
+    """quotes a path as a powershell string"""
+    return "'" + path.replace("'", "''") + "'"
+
+def sd_checkout(paths, cwd):
+    """opens paths for edit in source depot. returns the return code"""
+    # NOTE: set the execution policy to allow the script to be run
+    call = [POWERSHELL, '-ExecutionPolicy', 'Unrestricted', " & ", "sd edit"] + \
+        [quote_powershell(path) for path in paths]
+    return subprocess.call(call, cwd=cwd)
+
+def git_checkout(paths, cwd):
+    """a stand-in for sd_checkout in a git repository, which fails
+    if any of the paths isn't tracked. returns the return code"""
+    call = ["git", "ls-files", "--error-unmatch", "--"] + list(paths)
+    return subprocess.call(call, cwd=cwd, stdout=subprocess.DEVNULL)
+
+def no_checkout(paths, cwd):
+    """a stand-in for sd_checkout that doesn't check anything out"""
+    return 0
+
+CHECKOUT_BACKENDS = {"sd": sd_checkout, "git": git_checkout, "none": no_checkout}
+
+
+def chunk_paths(paths, limit=COMMAND_LINE_LIMIT):
+    """splits paths into lists whose command line, with each path quoted
+    and separated by a space, stays under limit characters"""
+    chunk = []
+    length = 0
+    for path in paths:
+        path_length = len(path) + 3
+        if chunk and length + path_length > limit:
+            yield chunk
+            chunk = []
+            length = 0
+        chunk.append(path)
+        length += path_length
+    if chunk:
+        yield chunk
+
+def checkout_chunk(chunk, checkout, cwd):
+    """checks out a chunk of paths, and returns the ones that failed. a
+    return code only says that something in the chunk failed, so a failed
+    chunk is split in half and each half checked out again"""
+    try:
+        ret_code = checkout(chunk, cwd)
+    except OSError as err:
+        # the command itself couldn't be run, so no path would do any better
+        print("checkout failed: ", err)
+        return list(chunk)
+    if ret_code == 0:
+        return []
+    if len(chunk) == 1:
+        return list(chunk)
+    middle = len(chunk) // 2
+    return checkout_chunk(chunk[:middle], checkout, cwd) + \
+        checkout_chunk(chunk[middle:], checkout, cwd)
+
+def checkout_files(paths, cwd, backend="sd", limit=COMMAND_LINE_LIMIT):
+    """checks out paths with the backend named in CHECKOUT_BACKENDS, or a function
+    taking a list of paths and the working folder and returning a return code.
+    returns the paths that couldn't be checked out"""
+    checkout = CHECKOUT_BACKENDS[backend] if isinstance(backend, str) else backend
+    failed = []
+    for chunk in chunk_paths(paths, limit):
+        failed += checkout_chunk(chunk, checkout, cwd)
+    return failed
@@ -0,0 +1,42 @@
+"""
+checks for the benchmark corpus and suite in benchmark.py, run with pytest
+"""
+
+import os
+
+import benchmark
+import xml_correction
+
+
+def test_corpus_converts(tmp_path, capsys):
+    corpus = benchmark.generate_corpus(str(tmp_path), 40)
+    assert len(corpus) == 40
+    assert len({info["title"] for info, _, _, _ in corpus}) == 40
+    for info, (orig, stub, htm), param_term, md_header in corpus:
+        assert all(os.path.exists(path) for path in (orig, stub, htm))
+        assert xml_correction.get_param_term(
+            xml_correction.fill_xml(htm, stub, orig)) == param_term
+    # every param in a stub is in its htm page
+    assert "NOT FOUND" not in capsys.readouterr().out
+
+
+def test_corpus_reuses_rows(tmp_path):
+    csv_loc = os.path.join(benchmark.PACKAGE_DIR, "type_mismatch_1.csv")
+    with open(csv_loc) as f:
+        rows = len(f.readlines()) - 1
+    corpus = benchmark.generate_corpus(str(tmp_path), rows * 2 + 3, [csv_loc])
+    titles = [info["title"] for info, _, _, _ in corpus]
+    assert len(set(titles)) == len(titles)
+    assert titles[rows] == titles[0] + "_c1"
+
+
+def test_report(tmp_path):
+    corpus = benchmark.generate_corpus(str(tmp_path / "corpus"), 10)
+    report = benchmark.run_suite(corpus, str(tmp_path / "output"), repeat=2)
+    assert report["meta"]["documents"] == 10
+    assert list(report["stages"]) == list(benchmark.SUITE_STAGES)
+    for stats in report["stages"].values():
+        assert stats["count"] == 20
+        assert stats["median_ms"] <= stats["p95_ms"] <= stats["max_ms"]
+    assert len(os.listdir(str(tmp_path / "output"))) == 10
+    assert set(benchmark.compare_reports(report, report).values()) == {1.0}
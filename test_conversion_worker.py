@@ -0,0 +1,142 @@
+"""
+checks for conversion_worker.py, run with pytest
+"""
+
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import benchmark
+import conversion_worker
+import header_mismatch
+import header_rewrite
+import xml_correction
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return benchmark.generate_corpus(str(tmp_path), 6)
+
+
+def get_converter(root):
+    return conversion_worker.Converter(str(root / "stub"), str(root / "sd"), checkout_backend="none")
+
+
+def run_lines(converter, jobs):
+    outfile = io.StringIO()
+    conversion_worker.serve_lines(converter, io.StringIO("".join(
+        job if isinstance(job, str) else json.dumps(job) + "\n" for job in jobs)), outfile)
+    return [json.loads(line) for line in outfile.getvalue().splitlines()]
+
+
+def test_convert_jobs_match_fill_xml(tmp_path, corpus):
+    converter = get_converter(tmp_path)
+    results = run_lines(converter, [{"id": i, "type": "convert", "row": info}
+                                    for i, (info, _, _, _) in enumerate(corpus)])
+    assert [result["id"] for result in results] == list(range(len(corpus)))
+    for result, (info, (orig, stub, htm), _, _) in zip(results, corpus):
+        assert result["ok"], result["error"]
+        assert result["xml"].encode("ascii") == \
+            xml_correction.serialize_tree(xml_correction.fill_xml(htm, stub, orig))
+        assert "parse_stub" in result["trace"]["stages"]
+    # the depot's folders are only listed for the first job of each
+    scans = converter.index.scans
+    run_lines(converter, [{"type": "convert", "row": corpus[0][0]}])
+    assert converter.index.scans == scans
+
+
+def test_convert_job_writes_output(tmp_path, corpus):
+    converter = get_converter(tmp_path)
+    job = {"type": "convert", "row": corpus[0][0], "output_dir": str(tmp_path / "out")}
+    first, second = run_lines(converter, [job, job])
+    assert (first["ok"], first["written"], second["written"]) == (True, True, False)
+    assert first["output"] == os.path.join(
+        xml_correction.get_output_dir(corpus[0][0], str(tmp_path / "out")),
+        xml_correction.get_output_filename(corpus[0][0]["title"]))
+    with open(first["output"], "rb") as f:
+        assert f.read().startswith(b'<?xml version="1.0" encoding="utf-8"?>')
+
+
+def test_files_added_while_running_are_found(tmp_path, corpus):
+    converter = get_converter(tmp_path)
+    info, (orig, stub, htm), _, _ = corpus[0]
+    os.rename(stub, stub + ".moved")
+    missing, = run_lines(converter, [{"type": "convert", "row": info}])
+    assert not missing["ok"]
+    assert missing["error"]["type"] == "FileNotFoundError"
+    os.rename(stub + ".moved", stub)
+    found, = run_lines(converter, [{"type": "convert", "row": info}])
+    assert found["ok"]
+
+
+def test_bad_jobs_get_errors(tmp_path, corpus):
+    results = run_lines(get_converter(tmp_path), [
+        "not json\n", "[1]\n", {"id": 1, "type": "unknown"}, {"id": 2, "type": "convert"},
+        {"id": 3, "type": "convert", "row": corpus[0][0]}])
+    assert [(result["id"], result["ok"]) for result in results] == \
+        [(None, False), (None, False), (1, False), (2, False), (3, True)]
+    assert results[2]["error"]["message"] == "unknown job type: unknown"
+    assert results[3]["error"]["type"] == "KeyError"
+
+
+def test_header_jobs(tmp_path):
+    file_loc = header_mismatch.get_file_loc("stream", "stream\\foo.htm", str(tmp_path / "sd"))
+    os.makedirs(os.path.dirname(file_loc))
+    content = "<info>\n<header><filename>wdm.h</filename>\n</header>\n</info>\n"
+    with open(file_loc, "w") as f:
+        f.write(content)
+    job = {"type": "header", "project": "stream", "xml_location": "stream\\foo.htm",
+           "header": "ntifs.h", "title": "Foo"}
+    dry_run, written = run_lines(get_converter(tmp_path), [dict(job, dry_run=True), job])
+    assert (dry_run["ok"], dry_run["file"], dry_run["changed"]) == (True, file_loc, True)
+    assert "+<header><filename>ntifs.h</filename>\n" in dry_run["diff"]
+    assert (written["ok"], written["changed"], "diff" in written) == (True, True, False)
+    with open(file_loc) as f:
+        assert f.read() == header_rewrite.rewrite_header(content, "ntifs.h", "Foo")
+
+
+def test_header_mismatch_runs_nothing_on_import():
+    # importing it used to fix the headers listed in CSV_LOC
+    subprocess.check_call([sys.executable, "-c", "import header_mismatch"],
+                          cwd=benchmark.PACKAGE_DIR)
+
+
+def test_stdin_worker(tmp_path, corpus):
+    jobs = "".join(json.dumps({"id": i, "type": "convert", "row": info}) + "\n"
+                   for i, (info, _, _, _) in enumerate(corpus))
+    run = subprocess.run([sys.executable, os.path.join(benchmark.PACKAGE_DIR, "conversion_worker.py"),
+                          "--stub-loc", str(tmp_path / "stub"), "--sd-loc", str(tmp_path / "sd")],
+                         input=jobs, capture_output=True, text=True, check=True)
+    results = [json.loads(line) for line in run.stdout.splitlines()]
+    assert [(result["id"], result["ok"]) for result in results] == \
+        [(i, True) for i in range(len(corpus))]
+    # progress goes to stderr
+    assert "converting: " in run.stderr
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs unix sockets")
+def test_socket_worker(tmp_path, corpus):
+    socket_path = str(tmp_path / "worker.sock")
+    converter = get_converter(tmp_path)
+    server = threading.Thread(target=conversion_worker.serve_socket, args=(converter, socket_path),
+                              daemon=True)
+    server.start()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for _ in range(2):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall("".join(json.dumps({"id": i, "type": "convert", "row": info}) + "\n"
+                                   for i, (info, _, _, _) in enumerate(corpus[:3])).encode("utf-8"))
+            client.shutdown(socket.SHUT_WR)
+            lines = client.makefile("r").read().splitlines()
+        assert [(json.loads(line)["id"], json.loads(line)["ok"]) for line in lines] == \
+            [(0, True), (1, True), (2, True)]
@@ -0,0 +1,60 @@
+"""
+checks for header_rewrite.py, run with pytest
+"""
+
+import random
+
+import pytest
+
+import benchmark
+import header_rewrite
+
+HEADER_PIECES = ["<header>", "<filename>", "</filename>", "</header>", "<include_header>",
+                 "</include_header>", "a.h", "B.h", "A.h", "x y", "\n", " ", "<info>", "</info>",
+                 "<info/>", "<p>t</p>", "<header><filename>a.h</filename>\n",
+                 "<include_header><filename>b.h</filename></include_header>\n"]
+
+
+def test_matches_old_version():
+    rng = random.Random(9)
+    for _ in range(20000):
+        content = "".join(rng.choice(HEADER_PIECES) for _ in range(rng.randint(0, 14)))
+        try:
+            expected = benchmark.rewrite_header_old(content, "new.h")
+        except AssertionError:
+            with pytest.raises(ValueError):
+                header_rewrite.rewrite_header(content, "new.h")
+            continue
+        assert header_rewrite.rewrite_header(content, "new.h") == expected, content
+
+
+def test_header_becomes_include_header():
+    content = "<info>\n<header><filename>wdm.h</filename>\n" \
+        "<include_header><filename>Ntddk.h</filename></include_header>\n" \
+        "<include_header><filename>ntddk.h</filename></include_header>\n</header>\n</info>\n"
+    assert header_rewrite.rewrite_header(content, "ntifs.h") == \
+        "<info>\n<header><filename>ntifs.h</filename>\n\n" \
+        "<include_header><filename>Ntddk.h</filename></include_header>\n" \
+        "<include_header><filename>wdm.h</filename></include_header>\n\n" \
+        "<include_header><filename>Ntddk.h</filename></include_header>\n" \
+        "<include_header><filename>wdm.h</filename></include_header>\n\n</header>\n</info>\n"
+
+
+def test_empty_info_gets_a_header():
+    assert header_rewrite.rewrite_header("<p/>\n<info/>\n", "wdm.h") == \
+        "<p/>\n<info>\n<header><filename>wdm.h</filename>\n</header>\n</info>\n"
+
+
+def test_missing_info_names_the_file():
+    with pytest.raises(ValueError, match="FooOpen does not have an info tag"):
+        header_rewrite.rewrite_header("<p/>\n", "wdm.h", "FooOpen")
+
+
+def test_diff():
+    content = "<info>\n<header><filename>wdm.h</filename>\n</header>\n</info>\n"
+    diff = header_rewrite.get_diff("sd\\foo.xml", content,
+                                   header_rewrite.rewrite_header(content, "ntifs.h"))
+    assert diff.startswith("--- sd\\foo.xml\n+++ sd\\foo.xml\n")
+    assert "-<header><filename>wdm.h</filename>\n" in diff
+    assert "+<header><filename>ntifs.h</filename>\n" in diff
+    assert "+<include_header><filename>wdm.h</filename></include_header>\n" in diff
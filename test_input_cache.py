@@ -0,0 +1,77 @@
+"""
+checks for input_cache.py, run with pytest
+"""
+
+import pickle
+
+import benchmark
+import input_cache
+import instrumentation
+import xml_backend
+import xml_correction
+
+
+def test_least_recently_used_are_dropped():
+    cache = input_cache.InputCache(max_bytes=100)
+    trace = instrumentation.RowTrace("t")
+    # values are kept the second time they're put
+    assert not cache.put("stub", ("a",), "A", 40)
+    assert cache.get("stub", ("a",)) is None
+    assert cache.put("stub", ("a",), "A", 40)
+    for _ in range(2):
+        cache.put("stub", ("b",), "B", 40)
+    assert cache.get("stub", ("a",), trace) == "A"
+    for _ in range(2):
+        cache.put("params", ("c",), "C", 40)
+    assert cache.get("stub", ("b",), trace) is None
+    assert cache.get("stub", ("a",)) == "A"
+    assert cache.get("params", ("c",)) == "C"
+    assert cache.size == 80
+    # too large to keep
+    for _ in range(2):
+        assert not cache.put("stub", ("d",), "D", 101)
+    assert cache.get("stub", ("d",)) is None
+    assert trace.counters == {"cache_hits_stub": 1, "cache_misses_stub": 1}
+    assert cache.stats["evictions"] == 1
+    assert input_cache.get_stats_summary(trace.counters) == ["stub: 1 hits, 1 misses, 0 from disk"]
+
+
+def test_disk_layer(tmp_path):
+    cache = input_cache.InputCache(cache_dir=str(tmp_path))
+    assert cache.load("params", ("p", "abc")) is None
+    cache.store("params", ("p", "abc"), b"{}")
+    later = input_cache.InputCache(cache_dir=str(tmp_path))
+    assert later.load("params", ("p", "abc")) == b"{}"
+    assert later.stats["disk_hits_params"] == 1
+    assert input_cache.InputCache().load("params", ("p", "abc")) is None
+
+
+def test_pickled_cache_is_the_process_cache(tmp_path):
+    cache = input_cache.InputCache(1000, str(tmp_path))
+    shared = pickle.loads(pickle.dumps(cache))
+    assert shared is input_cache.get_shared_cache(1000, str(tmp_path))
+    assert pickle.loads(pickle.dumps(cache)) is shared
+
+
+def test_cached_fill_matches_uncached(tmp_path):
+    corpus = benchmark.generate_corpus(str(tmp_path), 20)
+    for backend in xml_backend.BACKENDS:
+        cache = input_cache.InputCache()
+        trace = instrumentation.RowTrace("t")
+        for _ in range(2):
+            for info, (orig, stub, htm), _, _ in corpus:
+                expected = xml_correction.serialize_tree(
+                    xml_correction.fill_xml(htm, stub, orig, backend=backend))
+                assert xml_correction.serialize_tree(xml_correction.fill_xml(
+                    htm, stub, orig, trace, backend, cache=cache)) == expected
+        # the first fill of each document only marks it seen, so the second
+        # one's trees are kept, and later fills get copies of them
+        for _ in range(2):
+            for info, (orig, stub, htm), _, _ in corpus:
+                expected = xml_correction.serialize_tree(
+                    xml_correction.fill_xml(htm, stub, orig, backend=backend))
+                assert xml_correction.serialize_tree(xml_correction.fill_xml(
+                    htm, stub, orig, trace, backend, cache=cache)) == expected
+        for kind in ("stub", "orig", "params"):
+            assert trace.counters["cache_hits_" + kind] >= 20
+        assert (trace.counters["cache_misses_orig"], trace.counters["cache_hits_orig"]) == (40, 40)
@@ -0,0 +1,97 @@
+"""
+checks for manifest.py, run with pytest
+"""
+
+import os
+import re
+
+import pytest
+
+import manifest
+
+HEADER = "Title|Header in MD|Header in WDCML|Path in Kit|Area|Project|Type in MD|Type in WDCML|" \
+    "SubType in WDCML|Scraped|Scraped Status|Asset ID|Date Scraped|Xml Location|MD Location|Owner\n"
+
+
+def write_manifest(path, delimiter, rows):
+    with open(path, "w") as f:
+        f.write(HEADER.replace("|", delimiter) + "".join(delimiter.join(row) + "\n" for row in rows))
+    return str(path)
+
+
+def row(title, header_in_wdcml, path_in_kit):
+    return [title, "dbgeng.h", header_in_wdcml, path_in_kit, "WDK", "debugger", "function",
+            "method", "method", "N", "Type Mismatch", "4FDE0C39", "N/A",
+            "debugger\\" + title.lower() + ".htm", "dbgeng\\SkeletonMD\\nf-" + title.lower() + ".md",
+            "REDMOND\\domars"]
+
+
+def test_comma_manifest_lists_and_quotes(tmp_path):
+    csv_loc = write_manifest(tmp_path / "type_mismatch_9.csv", ",", [
+        row("GetThreadContext", "\"['Ntddk.h', 'Dbgeng.h']\"", ""),
+        row("SetThreadContext", "['Dbgeng.h']", "['Kernel_Mode_Headers_(x86)\\\\dbgeng.h']"),
+        row("RILADDRESSNUMPLAN", "[NONE]", "[]"),
+    ])
+    records = list(manifest.read_manifest(csv_loc))
+    assert [r.title for r in records] == ["GetThreadContext", "SetThreadContext", "RILADDRESSNUMPLAN"]
+    assert records[0].header_in_wdcml == ("Ntddk.h", "Dbgeng.h")
+    assert records[0].path_in_kit == ()
+    assert records[1].path_in_kit == ("Kernel_Mode_Headers_(x86)\\dbgeng.h",)
+    assert records[2].header_in_wdcml == ("NONE",)
+    assert records[2].owner == "REDMOND\\domars"
+    assert records[1].xml_location == "debugger\\setthreadcontext.htm"
+
+
+def test_pipe_manifest(tmp_path):
+    csv_loc = write_manifest(tmp_path / "Header_Mismatch_Data_9.csv", "|", [
+        row("tagKS_BDA_FRAME_INFO", "['bdamedia.h', 'Bdamedia.h']", ""),
+    ])
+    record = next(manifest.read_manifest(csv_loc))
+    assert record.header_in_wdcml == ("bdamedia.h", "Bdamedia.h")
+    assert record.subtype_in_wdcml == "method"
+
+
+def test_bad_row_names_the_line(tmp_path):
+    csv_loc = write_manifest(tmp_path / "type_mismatch_9.csv", ",", [
+        row("GetThreadContext", "[]", ""), row("Short", "[]", "")[:5]])
+    with pytest.raises(ValueError, match="line 3: expected 16 columns, found 5"):
+        list(manifest.read_manifest(csv_loc))
+
+
+@pytest.mark.parametrize("csv_name", ["type_mismatch_1.csv", "type_mismatch_3.csv",
+                                      "Header_Mismatch_Data_3.csv"])
+def test_matches_old_split(csv_name):
+    csv_loc = os.path.join(os.path.dirname(os.path.abspath(__file__)), csv_name)
+    with open(csv_loc) as f:
+        lines = f.readlines()[1:]
+    records = list(manifest.read_manifest(csv_loc))
+    assert len(records) == len(lines)
+    for line, record in zip(lines, records):
+        if "|" in line:
+            fields = line.split("|")
+        else:
+            fields = re.split(r",(?![^\[]*?[^\]]\])", line)
+        assert (record.title, record.header_in_md, record.project, record.type_in_wdcml,
+                record.subtype_in_wdcml, record.xml_location, record.md_location, record.owner) == \
+            (fields[0], fields[1], fields[5], fields[7], fields[8], fields[13], fields[14],
+             fields[15].rstrip("\n"))
+
+
+def test_manifests_are_deduplicated_by_asset_id(tmp_path):
+    first = row("GetThreadContext", "[]", "")
+    second = row("SetThreadContext", "[]", "")
+    second[11] = "5ABC"
+    repeated = row("GetThreadContext", "[]", "")
+    repeated[11] = " 4fde0c39 "
+    csv_locs = [write_manifest(tmp_path / "type_mismatch_8.csv", ",", [first, second]),
+                write_manifest(tmp_path / "type_mismatch_9.csv", ",", [repeated, second])]
+    duplicates = []
+    records = list(manifest.read_manifests(csv_locs, duplicates))
+    assert [r.title for r in records] == ["GetThreadContext", "SetThreadContext"]
+    assert [r.asset_id for r in duplicates] == [" 4fde0c39 ", "5ABC"]
+    # the shipped manifests share rows, but none repeats within a file
+    shipped = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "type_mismatch_" +
+                            str(i) + ".csv") for i in (1, 2, 3)]
+    records = list(manifest.read_manifests(shipped))
+    assert len({manifest.get_asset_key(r) for r in records}) == len(records)
+    assert len(records) < sum(len(list(manifest.read_manifest(c))) for c in shipped)
@@ -0,0 +1,56 @@
+"""
+checks for path_index.py, run with pytest
+"""
+
+import os
+
+import path_index
+
+
+def make_files(root, paths):
+    for path in paths:
+        path = os.path.join(str(root), *path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+
+def test_resolves_ignoring_case(tmp_path):
+    make_files(tmp_path, ["sd/Stream/stream/FooInit.xml", "sd/Stream/stream/Other.xml",
+                          "stub/hdr/SkeletonXML/nf-foo.xml"])
+    index = path_index.PathIndex([str(tmp_path / "sd"), str(tmp_path / "stub")])
+    assert index.resolve(str(tmp_path / "sd" / "stream" / "STREAM" / "fooinit.xml")) == \
+        str(tmp_path / "sd" / "Stream" / "stream" / "FooInit.xml")
+    assert index.resolve(str(tmp_path / "stub" / "HDR" / "skeletonxml" / "NF-FOO.xml")) == \
+        str(tmp_path / "stub" / "hdr" / "SkeletonXML" / "nf-foo.xml")
+    assert index.resolve(str(tmp_path / "sd" / "stream" / "stream" / "missing.xml")) is None
+    assert index.resolve(str(tmp_path / "sd" / "audio" / "audio" / "fooinit.xml")) is None
+    # each folder is listed once
+    scans = index.scans
+    index.resolve(str(tmp_path / "sd" / "Stream" / "stream" / "other.xml"))
+    assert index.scans == scans
+
+
+def test_exact_name_is_preferred(tmp_path):
+    make_files(tmp_path, ["sd/foo.xml", "sd/FOO.xml"])
+    index = path_index.PathIndex([str(tmp_path / "sd")])
+    assert index.resolve(str(tmp_path / "sd" / "FOO.xml")) == str(tmp_path / "sd" / "FOO.xml")
+    assert index.resolve(str(tmp_path / "sd" / "foo.xml")) == str(tmp_path / "sd" / "foo.xml")
+
+
+def test_forgotten_folders_are_listed_again(tmp_path):
+    make_files(tmp_path, ["sd/audio/audio/bar.xml"])
+    index = path_index.PathIndex([str(tmp_path / "sd")])
+    built = tmp_path / "sd" / "audio" / "build" / "HxS_MSDN"
+    assert index.resolve(str(built / "bar.htm")) is None
+    make_files(tmp_path, ["sd/audio/build/HxS_MSDN/bar.htm"])
+    assert index.resolve(str(built / "bar.htm")) is None
+    index.forget(str(built))
+    assert index.resolve(str(built / "bar.htm")) == str(built / "bar.htm")
+
+
+def test_paths_outside_roots_are_checked_directly(tmp_path):
+    make_files(tmp_path, ["other/a.xml"])
+    index = path_index.PathIndex([str(tmp_path / "sd")])
+    assert index.resolve(str(tmp_path / "other" / "a.xml")) == str(tmp_path / "other" / "a.xml")
+    assert index.resolve(str(tmp_path / "other" / "b.xml")) is None
+    assert index.scans == 0
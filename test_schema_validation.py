@@ -0,0 +1,108 @@
+"""
+checks for schema_validation.py, run with pytest
+"""
+
+import os
+import time
+
+import pytest
+
+import schema_validation
+
+needs_lxml = pytest.mark.skipif(schema_validation.etree is None, reason="needs lxml")
+
+# a small stand-in for wdcml.xsd: a function topic, whose metadata holds a
+# tech with one of a few values
+SCHEMA = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="http://microsoft.com/wdcml" xmlns="http://microsoft.com/wdcml"
+    elementFormDefault="qualified">
+  <xs:element name="function">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="metadata">
+          <xs:complexType>
+            <xs:sequence>
+              <xs:element name="tech">
+                <xs:complexType>
+                  <xs:attribute name="value" use="required">
+                    <xs:simpleType>
+                      <xs:restriction base="xs:string">
+                        <xs:enumeration value="kernel"/>
+                        <xs:enumeration value="user"/>
+                      </xs:restriction>
+                    </xs:simpleType>
+                  </xs:attribute>
+                </xs:complexType>
+              </xs:element>
+            </xs:sequence>
+            <xs:anyAttribute processContents="skip"/>
+          </xs:complexType>
+        </xs:element>
+        <xs:any minOccurs="0" maxOccurs="unbounded" processContents="skip"/>
+      </xs:sequence>
+      <xs:anyAttribute processContents="skip"/>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+
+def write_schema(sd_loc):
+    """writes the stand-in schema where the depot's schema goes"""
+    schema_loc = schema_validation.get_schema_loc(str(sd_loc))
+    os.makedirs(os.path.dirname(schema_loc), exist_ok=True)
+    with open(schema_loc, "w") as f:
+        f.write(SCHEMA)
+    return schema_loc
+
+
+def document(tech):
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<function xmlns="http://microsoft.com/wdcml">'
+            '<metadata type="function"><tech value="' + tech + '" /></metadata>'
+            '<content><p>text</p></content></function>').encode("ascii")
+
+
+@needs_lxml
+def test_validate(tmp_path):
+    schema_loc = write_schema(tmp_path)
+    schema_validation.validate(document("kernel"), schema_loc)
+    with pytest.raises(schema_validation.SchemaValidationError, match="not valid WDCML: line 2: .*tech.*stub"):
+        schema_validation.validate(document("stub"), schema_loc)
+    with pytest.raises(schema_validation.SchemaValidationError, match="not well formed"):
+        schema_validation.validate(b"<function>", schema_loc)
+
+
+@needs_lxml
+def test_schema_is_compiled_once(tmp_path):
+    schema_loc = write_schema(tmp_path)
+    schema = schema_validation.get_schema(schema_loc)
+    assert schema_validation.get_schema(schema_loc) is schema
+    # a changed schema is compiled again
+    with open(schema_loc, "a") as f:
+        f.write("\n")
+    stat = os.stat(schema_loc)
+    os.utime(schema_loc, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert schema_validation.get_schema(schema_loc) is not schema
+
+
+@needs_lxml
+@pytest.mark.parametrize("workers", [1, 2])
+def test_validate_files(tmp_path, workers):
+    schema_loc = write_schema(tmp_path / "sd")
+    paths = []
+    for i, tech in enumerate(["kernel", "stub", "user", "kernel"]):
+        paths.append(str(tmp_path / ("topic" + str(i) + ".xml")))
+        with open(paths[-1], "wb") as f:
+            f.write(document(tech))
+    paths.append(str(tmp_path / "missing.xml"))
+    results = list(schema_validation.validate_files(paths, schema_loc, workers))
+    assert [path for path, _ in results] == paths
+    assert [error is None for _, error in results] == [True, False, True, True, False]
+    assert results[1][1].startswith("SchemaValidationError: not valid WDCML")
+    assert results[4][1].startswith("FileNotFoundError")
+    assert list(schema_validation.iter_xml_files([str(tmp_path)])) == paths[:4]
+
+
+def test_missing_schema_fails_before_any_file(tmp_path):
+    with pytest.raises((OSError, ValueError)):
+        next(schema_validation.validate_files(["a.xml"], str(tmp_path / "wdcml.xsd")))
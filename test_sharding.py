@@ -0,0 +1,90 @@
+"""
+checks for sharding.py, run with pytest
+"""
+
+import os
+
+import pytest
+
+import benchmark
+import manifest
+import sharding
+import xml_correction
+
+MANIFESTS = [os.path.join(benchmark.PACKAGE_DIR, "type_mismatch_" + str(i) + ".csv") for i in (1, 2)]
+
+
+def test_shards_are_stable():
+    # the same on every machine, whatever the case of the project
+    assert sharding.get_shard("stream", 4) == sharding.get_shard("Stream", 4) == 0
+    assert sharding.parse_shard("2/4") == (1, 4)
+    for bad in ("0/4", "5/4", "2", "a/b"):
+        with pytest.raises(ValueError):
+            sharding.parse_shard(bad)
+
+
+def test_plan_splits_projects():
+    plan = sharding.plan_shards(MANIFESTS, 3)
+    records = list(manifest.read_manifests(MANIFESTS))
+    assert sum(sum(projects.values()) for projects in plan) == len(records)
+    # each project is in one shard
+    projects = [project for shard in plan for project in shard]
+    assert len(projects) == len(set(projects)) == len({r.project for r in records})
+
+
+def run_main(root, monkeypatch, folder, **kwargs):
+    os.makedirs(str(root / folder))
+    monkeypatch.chdir(root / folder)
+    xml_correction.main(csv_locs=MANIFESTS, **kwargs)
+
+
+def test_merged_shards_match_one_run(tmp_path, monkeypatch):
+    benchmark.generate_corpus(str(tmp_path), sum(len(list(manifest.read_manifest(csv_loc)))
+                                                  for csv_loc in MANIFESTS), MANIFESTS)
+    monkeypatch.setattr(xml_correction, "stub_loc", str(tmp_path / "stub"))
+    monkeypatch.setattr(xml_correction, "sd_loc", str(tmp_path / "sd"))
+    # a row that fails
+    os.remove(xml_correction.get_filepaths(
+        xml_correction.get_conversion_info(next(manifest.read_manifest(MANIFESTS[0]))),
+        str(tmp_path / "stub"), str(tmp_path / "sd"), build=False)[0])
+    run_main(tmp_path, monkeypatch, "single")
+    for index in range(3):
+        run_main(tmp_path, monkeypatch, "shard" + str(index), shard=(index, 3))
+    shard_dirs = [str(tmp_path / ("shard" + str(index))) for index in range(3)]
+    assert sharding.merge_shards(shard_dirs, str(tmp_path / "merged")) == []
+
+    def read_tree(root):
+        files = {}
+        for folder, _, names in os.walk(root):
+            for name in names:
+                with open(os.path.join(folder, name), "rb") as f:
+                    files[os.path.relpath(os.path.join(folder, name), root)] = f.read()
+        return files
+
+    single = read_tree(str(tmp_path / "single" / "out"))
+    assert len(single) == len(list(manifest.read_manifests(MANIFESTS))) - 1
+    assert read_tree(str(tmp_path / "merged" / "out")) == single
+    assert sorted(sharding.read_failures(str(tmp_path / "merged" / "failed_files.txt"))) == \
+        sorted(sharding.read_failures(str(tmp_path / "single" / "failed_files.txt")))
+    assert len(sharding.read_failures(str(tmp_path / "single" / "failed_files.txt"))) == 1
+
+
+def test_merge_reports_conflicts(tmp_path):
+    for shard, content in (("a", "one"), ("b", "two"), ("c", "one")):
+        os.makedirs(str(tmp_path / shard / "out" / "bagold" / "stream"))
+        for name in ("foo.xml", shard + ".xml"):
+            with open(str(tmp_path / shard / "out" / "bagold" / "stream" / name), "w") as f:
+                f.write(content)
+    with open(str(tmp_path / "a" / "failed_files.txt"), "w") as f:
+        f.write("title: Bar\nproject: audio\n\ntitle: Baz\nproject: audio\n\n")
+    shard_dirs = [str(tmp_path / shard) for shard in ("a", "b", "c")]
+    conflicts = sharding.merge_shards(shard_dirs, str(tmp_path / "merged"))
+    assert conflicts == [(os.path.join("bagold", "stream", "foo.xml"), shard_dirs)]
+    with open(str(tmp_path / "merged" / "out" / "bagold" / "stream" / "foo.xml")) as f:
+        assert f.read() == "one"
+    assert sorted(os.listdir(str(tmp_path / "merged" / "out" / "bagold" / "stream"))) == \
+        ["a.xml", "b.xml", "c.xml", "foo.xml"]
+    with open(str(tmp_path / "merged" / "merge_conflicts.txt")) as f:
+        assert f.read().startswith(os.path.join("bagold", "stream", "foo.xml") + ": written differently")
+    assert sharding.read_failures(str(tmp_path / "merged" / "failed_files.txt")) == \
+        ["title: Bar\nproject: audio\n", "title: Baz\nproject: audio\n"]
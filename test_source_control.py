@@ -0,0 +1,48 @@
+"""
+checks for source_control.py, run with pytest
+"""
+
+import subprocess
+
+import source_control
+
+
+def test_chunks_stay_under_limit():
+    paths = ["sd\\project\\topic" + str(i) + ".xml" for i in range(1000)]
+    chunks = list(source_control.chunk_paths(paths, limit=500))
+    assert sum(chunks, []) == paths
+    for chunk in chunks:
+        assert sum(len(path) + 3 for path in chunk) <= 500
+    # a path longer than the limit still gets a chunk of its own
+    assert list(source_control.chunk_paths(["x" * 600, "y"], limit=500)) == [["x" * 600], ["y"]]
+
+
+def test_failed_paths_are_found_in_a_chunk():
+    calls = []
+    bad = {"topic7.xml", "topic40.xml"}
+
+    def checkout(paths, cwd):
+        calls.append(len(paths))
+        return 1 if bad & set(paths) else 0
+
+    paths = ["topic" + str(i) + ".xml" for i in range(64)]
+    assert sorted(source_control.checkout_files(paths, ".", checkout)) == sorted(bad)
+    assert calls[0] == 64
+    assert len(calls) < 30
+
+
+def test_unrunnable_command_fails_every_path():
+    def checkout(paths, cwd):
+        raise FileNotFoundError("powershell.exe")
+
+    assert source_control.checkout_files(["a.xml", "b.xml"], ".", checkout) == ["a.xml", "b.xml"]
+
+
+def test_git_backend(tmp_path):
+    subprocess.check_call(["git", "init", "-q"], cwd=str(tmp_path))
+    for name in ("tracked.xml", "untracked.xml"):
+        (tmp_path / name).write_text("<a/>")
+    subprocess.check_call(["git", "add", "tracked.xml"], cwd=str(tmp_path))
+    assert source_control.checkout_files(["tracked.xml", "untracked.xml"], str(tmp_path), "git") == \
+        ["untracked.xml"]
+    assert source_control.checkout_files(["untracked.xml"], str(tmp_path), "none") == []
@@ -0,0 +1,54 @@
+"""
+checks for xml_backend.py, run with pytest. the lxml checks are skipped
+when lxml isn't installed
+"""
+
+import pytest
+
+import benchmark
+import xml_backend
+import xml_correction
+
+needs_lxml = pytest.mark.skipif("lxml" not in xml_backend.BACKENDS, reason="lxml isn't installed")
+
+# the places lxml's output differs from ElementTree's: empty elements, tabs
+# in attributes, non-ascii text, and a root attribute on an empty root
+EDGE_DOCUMENTS = [
+    b"<function><a/><b></b><c x='1&#9;2'>t &amp; &lt; &gt; \"q\"</c>tail</function>",
+    b"<function/>",
+    b"<function><!-- comment --><?pi x?><desc>\xc3\xa9\xe2\x80\x94</desc></function>",
+]
+
+
+def serialize(backend, xml_bytes, text=None):
+    backend = xml_backend.get_backend(backend)
+    tree = xml_correction.IndexedTree(backend.parse(xml_bytes), backend=backend)
+    if text is not None:
+        tree.getroot().text = text
+    backend.set_root_attributes(tree, {"xmlns:x": "http://www.w3.org/1999/xhtml",
+                                       "xsi:schemaLocation": "a\tb&c"})
+    return xml_correction.serialize_tree(tree)
+
+
+@needs_lxml
+@pytest.mark.parametrize("xml_bytes", EDGE_DOCUMENTS)
+def test_backends_serialize_the_same(xml_bytes):
+    assert serialize("lxml", xml_bytes) == serialize("etree", xml_bytes)
+    assert serialize("lxml", xml_bytes, "set — text") == \
+        serialize("etree", xml_bytes, "set — text")
+
+
+@needs_lxml
+def test_backends_fill_the_same(tmp_path):
+    corpus = benchmark.generate_corpus(str(tmp_path), 200)
+    for _, (orig, stub, htm), _, _ in corpus:
+        assert xml_correction.serialize_tree(
+            xml_correction.fill_xml(htm, stub, orig, backend="lxml")) == \
+            xml_correction.serialize_tree(
+                xml_correction.fill_xml(htm, stub, orig, backend="etree")), orig
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="xml backend not available: minidom"):
+        xml_backend.get_backend("minidom")
+    assert xml_backend.get_backend().name == xml_backend.DEFAULT_BACKEND
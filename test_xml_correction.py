@@ -0,0 +1,680 @@
+"""
+regression checks for xml_correction.py, run with pytest. each test builds a
+small depot of stub, original and htm files in a temporary folder
+"""
+
+import json
+import os
+import random
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+import benchmark
+import test_schema_validation
+import xml_backend
+import xml_correction
+
+CSV_HEADER = "Title,Header in MD,Header in WDCML,Path in Kit,Area,Project,Type in MD," \
+    "Type in WDCML,SubType in WDCML,Scraped,Scraped Status,Asset ID,Date Scraped," \
+    "Xml Location,MD Location,Owner\n"
+
+ROOT_ATTRIBUTES = ' xsi:schemaLocation="http://microsoft.com/wdcml ../../BuildX/Schema/xsd/wdcml.xsd"' \
+    ' xmlns="http://microsoft.com/wdcml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n' \
+    '<?xml-stylesheet type="text/xsl" href="../../BuildX/Script2/preview.xslt"?>\n'
+
+
+def stub_xml(pagetype, params):
+    """a stub WDCML document with empty param descriptions"""
+    param_xml = "".join("<param><name>" + name + "</name><desc><p>stub</p></desc></param>\n"
+                        for name in params)
+    return DECLARATION + "<" + pagetype + ROOT_ATTRIBUTES + ">\n" \
+        '<metadata type="' + pagetype + '" msdnID="" beta="1">\n<tech value="stub"/>\n</metadata>\n' \
+        "<content>\n<desc><p>stub abstract</p></desc>\n" \
+        "<syntax>\n<params>\n" + param_xml + "</params>\n</syntax>\n" \
+        "</content>\n</" + pagetype + ">\n"
+
+
+def orig_xml(pagetype, title, params, paragraphs=3):
+    """an original WDCML document, with the sections fill_xml transfers"""
+    param_xml = "".join("<param><name>" + name + "</name><desc><p>orig</p></desc></param>\n"
+                        for name in params)
+    filler = "".join("<p>remark paragraph " + str(i) + "</p>\n" for i in range(paragraphs))
+    return DECLARATION + "<" + pagetype + ROOT_ATTRIBUTES + ">\n" \
+        '<metadata type="' + pagetype + '" msdnID="ff557' + str(len(title)) + '">\n' \
+        '<tech value="kernel"/>\n</metadata>\n' \
+        "<content>\n<desc><p><abstract>The " + title + " routine.</abstract></p></desc>\n" \
+        "<syntax>\n<params>\n" + param_xml + "</params>\n" \
+        "<retval><p>Returns STATUS_SUCCESS.</p></retval>\n</syntax>\n" \
+        "<remarks>\n" + filler + "</remarks>\n" \
+        "<info><p>info</p></info>\n<seealso><p>see also</p></seealso>\n" \
+        "</content>\n</" + pagetype + ">\n"
+
+
+def htm_page(title, params):
+    """a built HxS_MSDN page for a topic"""
+    param_html = "".join("<dt><i>" + name + "</i> [in]</dt>\n<dd>\n<p>Describes " + name +
+                         ".</p>\n</dd>\n" for name in params)
+    return "<html><body><h1>" + title + "</h1>\n<h2>Parameters</h2>\n<dl>\n" + param_html + \
+        "</dl>\n<h2>Return value</h2>\n<p>STATUS_SUCCESS</p>\n</body></html>\n"
+
+
+def add_row(depot, title, project, params=("Device",), owner="bagold", write_orig=True):
+    """writes a topic's three files into depot, and returns its manifest line"""
+    name = title.lower()
+    md_location = "hdr\\SkeletonMD\\nf-hdr-" + name + ".md"
+    htm_location = project + "\\" + name + ".htm"
+    row = {"title": title, "project": project, "htm_location": htm_location,
+           "md_location": md_location, "owner": "REDMOND\\" + owner + "\n"}
+    orig, stub, htm = xml_correction.get_filepaths(
+        row, str(depot / "stub"), str(depot / "sd"), build=False)
+    for path in (orig, stub, htm):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if write_orig:
+        with open(orig, "w", encoding="utf-8") as f:
+            f.write(orig_xml("function", title, params))
+    with open(stub, "w", encoding="utf-8") as f:
+        f.write(stub_xml("function", params))
+    with open(htm, "w") as f:
+        f.write(htm_page(title, params))
+    return ",".join([title, "hdr.h", "['Hdr.h']", "['Kernel_Mode_Headers\\\\hdr.h']", "WDK", project,
+                     "function", "macro", "macro", "N", "Type Mismatch",
+                     "264088F1-B717-4F2D-82DD-B393A656" + str(len(title)).zfill(4), "N/A",
+                     htm_location, md_location, "REDMOND\\" + owner]) + "\n"
+
+
+@pytest.fixture
+def depot(tmp_path, monkeypatch):
+    """a temporary depot with a manifest of four rows, one of them broken.
+    the working directory and the module's depot locations point at it"""
+    lines = [
+        add_row(tmp_path, "FooInitialize", "stream", ("Device", "Flags")),
+        add_row(tmp_path, "FooClose", "stream"),
+        add_row(tmp_path, "BarOpen", "audio", ("Handle",), owner="domars"),
+        add_row(tmp_path, "BarBroken", "audio", write_orig=False, owner="domars"),
+    ]
+    with open(tmp_path / "type_mismatch_3.csv", "w") as f:
+        f.write(CSV_HEADER + "".join(lines))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(xml_correction, "stub_loc", str(tmp_path / "stub"))
+    monkeypatch.setattr(xml_correction, "sd_loc", str(tmp_path / "sd"))
+    return tmp_path
+
+
+def read_outputs(root):
+    """maps each file under root/out to its bytes"""
+    outputs = {}
+    for folder, _, files in os.walk(os.path.join(root, "out")):
+        for name in files:
+            with open(os.path.join(folder, name), "rb") as f:
+                outputs[os.path.relpath(os.path.join(folder, name), root)] = f.read()
+    return outputs
+
+
+def failed_titles(root):
+    with open(os.path.join(root, "failed_files.txt")) as f:
+        return [line[len("title: "):].strip() for line in f if line.startswith("title: ")]
+
+
+def test_main_converts_rows(depot):
+    xml_correction.main()
+    outputs = read_outputs(depot)
+    assert sorted(outputs) == [os.path.join("out", "bagold", "stream", "fooclose.xml"),
+                               os.path.join("out", "bagold", "stream", "fooinitialize.xml"),
+                               os.path.join("out", "domars", "audio", "baropen.xml")]
+    converted = outputs[os.path.join("out", "bagold", "stream", "fooinitialize.xml")]
+    assert converted.startswith(b'<?xml version="1.0" encoding="utf-8"?>')
+    assert b"<desc>Describes Flags." in converted
+    assert b'msdnID="ff55713"' in converted
+    assert failed_titles(depot) == ["BarBroken"]
+
+
+def test_failure_record_names_worker_and_exception(depot):
+    xml_correction.main()
+    with open("failed_files.txt") as f:
+        record = f.read()
+    assert "worker: MainProcess\n" in record
+    assert "error: FileNotFoundError: " in record
+
+
+def test_trace_records_stages_counters_and_errors(depot, monkeypatch):
+    # FooClose's htm page is missing its param, and audio's html has to be built
+    orig, stub, htm = xml_correction.get_filepaths(
+        xml_correction.get_file_mapping("type_mismatch_3.csv")["FooClose"],
+        xml_correction.stub_loc, xml_correction.sd_loc, build=False)
+    with open(htm, "w") as f:
+        f.write(htm_page("FooClose", ()))
+    os.rename(xml_correction.get_htm_build_path("audio", str(depot / "sd")),
+              str(depot / "audio_htm"))
+
+    def fake_build(project_path, build_command=None):
+        os.rename(str(depot / "audio_htm"), xml_correction.get_htm_build_path(
+            "audio", str(depot / "sd")))
+        return 0
+
+    monkeypatch.setattr(xml_correction, "generate_project_html", fake_build)
+    xml_correction.main(trace_file="trace.jsonl")
+    with open("trace.jsonl") as f:
+        traces = {trace["title"]: trace for trace in map(json.loads, f)}
+    assert sorted(traces) == ["BarBroken", "BarOpen", "FooClose", "FooInitialize"]
+    assert list(traces["FooInitialize"]["stages"]) == [
+        "check_inputs", "read_wait", "preprocess_stub", "parse_stub", "preprocess_orig", "parse_orig",
+        "transfer_metadata", "extract_params", "add_params", "add_abstract", "transfer_remarks",
+        "transfer_seealso", "transfer_info", "transfer_retval", "serialize", "write"]
+    assert traces["FooInitialize"]["error"] is None
+    assert traces["FooClose"]["counters"] == {"param_not_found": 1, "cache_misses_stub": 1,
+                                              "cache_misses_orig": 1, "cache_misses_params": 1}
+    # the build is timed on the row that started it
+    assert "build" in traces["BarOpen"]["stages"]
+    # the missing orig is found before the row is converted
+    error = traces["BarBroken"]["error"]
+    assert error["type"] == "FileNotFoundError"
+    assert list(traces["BarBroken"]["stages"]) == ["check_inputs"]
+    with open("trace_summary.json") as f:
+        summary = json.load(f)
+    assert (summary["rows"], summary["failures"]) == (4, 1)
+    assert summary["counters"] == {"param_not_found": 1, "cache_misses_stub": 3,
+                                   "cache_misses_orig": 3, "cache_misses_params": 3}
+    assert len(summary["slowest_rows"]) == 4
+
+
+def test_workers_match_serial_run(depot):
+    xml_correction.main()
+    serial_outputs = read_outputs(depot)
+    serial_failures = failed_titles(depot)
+    xml_correction.main(workers=2, resume=False)
+    assert read_outputs(depot) == serial_outputs
+    assert failed_titles(depot) == serial_failures
+
+
+def test_missing_project_is_built_once(depot, monkeypatch):
+    built = []
+
+    def fake_build(project_path, build_command=None):
+        built.append(os.path.basename(project_path))
+        return 1
+
+    for project in ("stream", "audio"):
+        os.rename(xml_correction.get_htm_build_path(project, str(depot / "sd")),
+                  str(depot / (project + "_htm")))
+    monkeypatch.setattr(xml_correction, "generate_project_html", fake_build)
+    xml_correction.main(workers=2)
+    assert sorted(built) == ["audio", "stream"]
+    assert failed_titles(depot) == ["FooInitialize", "FooClose", "BarOpen", "BarBroken"]
+    with open("failed_files.txt") as f:
+        assert "worker: html-build" in f.read()
+
+
+def test_built_projects_convert_during_builds(depot, monkeypatch):
+    built_output = os.path.join("out", "domars", "audio", "baropen.xml")
+    seen = []
+
+    def slow_build(project_path, build_command=None):
+        # the build only finishes once a row of the built project has been written
+        deadline = time.monotonic() + 10
+        while not os.path.exists(built_output) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        seen.append(os.path.exists(built_output))
+        os.rename(str(depot / "stream_htm"), xml_correction.get_htm_build_path(
+            "stream", str(depot / "sd")))
+        return 0
+
+    os.rename(xml_correction.get_htm_build_path("stream", str(depot / "sd")),
+              str(depot / "stream_htm"))
+    monkeypatch.setattr(xml_correction, "generate_project_html", slow_build)
+    xml_correction.main()
+    assert seen == [True]
+    assert len(read_outputs(depot)) == 3
+    assert failed_titles(depot) == ["BarBroken"]
+
+
+def test_build_command_runs_in_project_folder(depot):
+    os.rename(xml_correction.get_htm_build_path("audio", str(depot / "sd")),
+              str(depot / "audio_htm"))
+    stand_in = "import os; os.rename(os.path.join('..', '..', 'audio_htm'), " \
+        "os.path.join('build', 'HxS_MSDN'))"
+    xml_correction.main(build_command=[sys.executable, "-c", stand_in])
+    assert len(read_outputs(depot)) == 3
+    assert failed_titles(depot) == ["BarBroken"]
+
+
+def test_conversion_starts_before_manifest_is_read(depot):
+    read = []
+
+    def manifest_rows():
+        for conversion_info in xml_correction.iter_conversion_rows("type_mismatch_3.csv"):
+            read.append(conversion_info["title"])
+            yield conversion_info
+
+    results = xml_correction.convert_rows(manifest_rows(), xml_correction.stub_loc,
+                                          xml_correction.sd_loc, prefetch=0)
+    position, (conversion_info, xml_bytes, failure, trace) = next(results)
+    assert (position, conversion_info["title"], failure) == (0, "FooInitialize", None)
+    assert read == ["FooInitialize"]
+    results.close()
+    # only the rows that are read ahead are read from the manifest
+    del read[:]
+    results = xml_correction.convert_rows(manifest_rows(), xml_correction.stub_loc,
+                                          xml_correction.sd_loc, prefetch=2)
+    position, (conversion_info, xml_bytes, failure, trace) = next(results)
+    assert (position, conversion_info["title"], failure) == (0, "FooInitialize", None)
+    assert read == ["FooInitialize", "FooClose", "BarOpen"]
+    results.close()
+
+
+def test_rows_are_checked_against_the_path_index(depot, monkeypatch):
+    rows = xml_correction.get_file_mapping("type_mismatch_3.csv")
+    # a stub cased differently from the manifest, and a missing one
+    orig, stub, htm = xml_correction.get_filepaths(rows["FooInitialize"], xml_correction.stub_loc,
+                                                   xml_correction.sd_loc, build=False)
+    os.rename(stub, os.path.join(os.path.dirname(stub), os.path.basename(stub).upper()))
+    orig, stub, htm = xml_correction.get_filepaths(rows["BarOpen"], xml_correction.stub_loc,
+                                                   xml_correction.sd_loc, build=False)
+    os.remove(stub)
+    converted = count_conversions(monkeypatch)
+    xml_correction.main()
+    assert converted == ["FooInitialize", "FooClose"]
+    assert len(read_outputs(depot)) == 2
+    assert failed_titles(depot) == ["BarOpen", "BarBroken"]
+    with open("failed_files.txt") as f:
+        assert "error: FileNotFoundError: [Errno 2] No such file or directory: " + repr(stub) \
+            in f.read()
+
+
+@pytest.mark.skipif(xml_backend.etree is None, reason="needs lxml")
+def test_invalid_files_fail_validation(depot):
+    test_schema_validation.write_schema(depot / "sd")
+    # the original's tech is copied to the stub, and the schema doesn't allow this one
+    orig, stub, htm = xml_correction.get_filepaths(
+        xml_correction.get_file_mapping("type_mismatch_3.csv")["FooClose"],
+        xml_correction.stub_loc, xml_correction.sd_loc, build=False)
+    with open(orig) as f:
+        content = f.read()
+    with open(orig, "w") as f:
+        f.write(content.replace('<tech value="kernel"/>', '<tech value="stub"/>'))
+    xml_correction.main(validate=True, trace_file="trace.jsonl")
+    assert sorted(read_outputs(depot)) == [os.path.join("out", "bagold", "stream", "fooinitialize.xml"),
+                                           os.path.join("out", "domars", "audio", "baropen.xml")]
+    assert failed_titles(depot) == ["FooClose", "BarBroken"]
+    with open("failed_files.txt") as f:
+        assert "error: SchemaValidationError: not valid WDCML: line " in f.read()
+    with open("trace.jsonl") as f:
+        traces = {trace["title"]: trace for trace in map(json.loads, f)}
+    assert "validate" in traces["FooInitialize"]["stages"]
+    # with workers, the files are validated on the worker processes
+    xml_correction.main(validate=True, workers=2, resume=False)
+    assert failed_titles(depot) == ["FooClose", "BarBroken"]
+
+
+def test_cache_dir_warms_later_runs(depot, capsys):
+    xml_correction.main(cache_size=0)
+    outputs = read_outputs(depot)
+    assert "input cache:" not in capsys.readouterr().out
+    xml_correction.main(resume=False, cache_dir="cache")
+    assert "   stub: 0 hits, 3 misses, 0 from disk\n" in capsys.readouterr().out
+    # a later run finds the preprocessed xml and the params in the folder
+    xml_correction.main(resume=False, cache_dir="cache", workers=2)
+    out = capsys.readouterr().out
+    assert "   params: 0 hits, 3 misses, 3 from disk\n" in out
+    assert "   preprocessed: 0 hits, 0 misses, 6 from disk\n" in out
+    assert read_outputs(depot) == outputs
+
+
+def test_prefetch_inputs_reads_rows_in_order(depot):
+    rows = list(xml_correction.iter_conversion_rows("type_mismatch_3.csv"))
+    prefetched = list(xml_correction.prefetch_inputs(rows, xml_correction.stub_loc,
+                                                     xml_correction.sd_loc, depth=2))
+    assert [conversion_info for conversion_info, _ in prefetched] == rows
+    for conversion_info, inputs in prefetched:
+        paths = xml_correction.get_filepaths(conversion_info, xml_correction.stub_loc,
+                                             xml_correction.sd_loc, build=False)
+        assert [input_file.path for input_file in inputs.result()] == list(paths)
+        for input_file in inputs.result():
+            if os.path.exists(input_file.path):
+                with open(input_file.path, "rb") as f:
+                    assert (input_file.data, input_file.error) == (f.read(), None)
+    # a missing file is only raised once it's used
+    orig = prefetched[3][1].result()[0]
+    assert orig.data is None
+    with pytest.raises(FileNotFoundError):
+        xml_correction.preprocess_xml(orig)
+
+
+def test_prefetcher_keeps_to_depth_and_budget(monkeypatch):
+    started = []
+    release = threading.Event()
+
+    def read_row_inputs(conversion_info, stub_loc, sd_loc, index=None):
+        started.append(conversion_info["title"])
+        if conversion_info["block"]:
+            release.wait(10)
+        return (xml_correction.InputFile("orig.xml", b"x" * 100, None),)
+
+    def wait_for_reads(count):
+        deadline = time.monotonic() + 10
+        while len(started) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # give a read that shouldn't start the time to
+        time.sleep(0.05)
+
+    monkeypatch.setattr(xml_correction, "read_row_inputs", read_row_inputs)
+    with xml_correction.InputPrefetcher("stub", "sd", depth=3, threads=3) as prefetcher:
+        for i in range(6):
+            prefetcher.add(i, {"title": i, "block": True})
+        wait_for_reads(3)
+        assert started == [0, 1, 2]
+        release.set()
+        assert prefetcher.take(0).result()[0].data == b"x" * 100
+        wait_for_reads(4)
+        assert started == [0, 1, 2, 3]
+
+    del started[:]
+    with xml_correction.InputPrefetcher("stub", "sd", depth=8, budget=250) as prefetcher:
+        for i in range(5):
+            prefetcher.add(i, {"title": i, "block": False})
+            # the read finishes before the next row is added
+            wait_for_reads(min(i + 1, 3))
+        # three finished reads hold 300 bytes
+        assert started == [0, 1, 2]
+        prefetcher.take(0)
+        wait_for_reads(4)
+        assert started == [0, 1, 2, 3]
+        # a row that's taken is read even when over budget
+        prefetcher.take(4).result()
+        assert started == [0, 1, 2, 3, 4]
+
+
+def test_prefetch_matches_reading_each_row(depot):
+    xml_correction.main(prefetch=0)
+    outputs = read_outputs(depot)
+    with open("failed_files.txt") as f:
+        failures = f.read()
+    xml_correction.main(prefetch=2, resume=False)
+    assert read_outputs(depot) == outputs
+    with open("failed_files.txt") as f:
+        assert f.read() == failures
+
+
+def count_conversions(monkeypatch):
+    """records the titles of the rows converted in this process"""
+    converted = []
+    convert_row = xml_correction.convert_row
+
+    def counting_convert_row(conversion_info, *args, **kwargs):
+        converted.append(conversion_info["title"])
+        return convert_row(conversion_info, *args, **kwargs)
+
+    monkeypatch.setattr(xml_correction, "convert_row", counting_convert_row)
+    return converted
+
+
+def test_rerun_skips_up_to_date_rows(depot, monkeypatch):
+    xml_correction.main()
+    first_outputs = read_outputs(depot)
+    converted = count_conversions(monkeypatch)
+    xml_correction.main()
+    assert converted == []
+    assert failed_titles(depot) == ["BarBroken"]
+
+    # an upstream fix to one stub
+    orig, stub, htm = xml_correction.get_filepaths(
+        xml_correction.get_file_mapping("type_mismatch_3.csv")["FooClose"],
+        xml_correction.stub_loc, xml_correction.sd_loc, build=False)
+    with open(stub, "a") as f:
+        f.write("\n")
+    del converted[:]
+    xml_correction.main()
+    assert converted == ["FooClose"]
+    assert read_outputs(depot) == first_outputs
+
+    del converted[:]
+    xml_correction.main(resume=False)
+    assert converted == ["FooInitialize", "FooClose", "BarOpen"]
+
+
+def test_killed_run_resumes(depot, monkeypatch):
+    xml_correction.main()
+    full_outputs = read_outputs(depot)
+    os.remove("conversion_journal.jsonl")
+    for name in list(full_outputs):
+        os.remove(name)
+
+    write_serialized = xml_correction.write_serialized
+    writes = []
+
+    def killed_after_one(xml_bytes, filename, output_path):
+        if writes:
+            raise KeyboardInterrupt
+        writes.append(filename)
+        write_serialized(xml_bytes, filename, output_path)
+
+    monkeypatch.setattr(xml_correction, "write_serialized", killed_after_one)
+    with pytest.raises(KeyboardInterrupt):
+        xml_correction.main()
+    # a journal line cut short by the kill
+    with open("conversion_journal.jsonl", "a") as f:
+        f.write('{"row": {"title": "FooCl')
+    monkeypatch.setattr(xml_correction, "write_serialized", write_serialized)
+    converted = count_conversions(monkeypatch)
+    xml_correction.main()
+    assert converted == ["FooClose", "BarOpen"]
+    assert read_outputs(depot) == full_outputs
+
+
+def test_unchanged_outputs_are_not_rewritten(depot):
+    xml_correction.main()
+    mtimes = {name: os.stat(name).st_mtime_ns for name in read_outputs(depot)}
+    time.sleep(0.01)
+    xml_correction.main(resume=False)
+    assert {name: os.stat(name).st_mtime_ns for name in read_outputs(depot)} == mtimes
+
+
+def test_write_atomic(tmp_path, monkeypatch):
+    path = str(tmp_path / "topic.xml")
+    assert xml_correction.write_atomic(path, b"<a/>")
+    assert not xml_correction.write_atomic(path, b"<a/>")
+
+    def crash(src, dst):
+        raise OSError("share went away")
+
+    monkeypatch.setattr(xml_correction.os, "replace", crash)
+    with pytest.raises(OSError):
+        xml_correction.write_atomic(path, b"<b/>")
+    with open(path, "rb") as f:
+        assert f.read() == b"<a/>"
+    assert os.listdir(str(tmp_path)) == ["topic.xml"]
+
+
+@pytest.mark.parametrize("archive_name", ["out.zip", "out.tar.gz"])
+def test_archive_holds_the_same_files(depot, archive_name):
+    xml_correction.main()
+    outputs = read_outputs(depot)
+    with open("conversion_journal.jsonl") as f:
+        journal = f.read()
+    xml_correction.main(output_archive=archive_name)
+    if archive_name.endswith(".zip"):
+        with zipfile.ZipFile(archive_name) as archive:
+            archived = {name: archive.read(name) for name in archive.namelist()}
+    else:
+        with tarfile.open(archive_name) as archive:
+            archived = {member.name: archive.extractfile(member).read()
+                        for member in archive.getmembers()}
+    assert archived == {name.replace(os.sep, "/"): data for name, data in outputs.items()}
+    assert failed_titles(depot) == ["BarBroken"]
+    with open("conversion_journal.jsonl") as f:
+        assert f.read() == journal
+    assert not [name for name in os.listdir(str(depot)) if name.endswith(".tmp")]
+
+
+PREPROCESS_PIECES = ['<?xml version="1.0"?>', '<?xml-stylesheet href="x"?>', "<function", "<b",
+                     ' xmlns="http://microsoft.com/wdcml"', "\txmlns='y'", ' xsi:schemaLocation="a b"',
+                     ">", "\n", "text", "é", "—", " ", "</b>", "<p>", "</p>"]
+
+
+def test_preprocess_matches_old_version(tmp_path):
+    rng = random.Random(4)
+    xml_file = str(tmp_path / "fragment.xml")
+    for _ in range(3000):
+        fragment = "".join(rng.choice(PREPROCESS_PIECES) for _ in range(rng.randint(0, 20)))
+        with open(xml_file, "w", encoding="utf-8", newline="") as f:
+            f.write(fragment)
+        assert xml_correction.preprocess_xml(xml_file).decode("ascii") == \
+            benchmark.preprocess_xml_old(xml_file), fragment
+
+
+def test_preprocess_keeps_declaration_before_non_ascii(tmp_path):
+    xml_file = str(tmp_path / "declaration.xml")
+    with open(xml_file, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0"?>é\n<a/>\n')
+    assert xml_correction.preprocess_xml(xml_file) == b'<?xml version="1.0"?>\n<a/>\n'
+
+
+def test_preprocess_crlf_file_parses_to_same_tree(tmp_path):
+    xml_file = str(tmp_path / "crlf.xml")
+    with open(xml_file, "w", encoding="utf-8", newline="") as f:
+        f.write(stub_xml("function", ("Device",)).replace("\n", "\r\n"))
+    assert benchmark.same_preprocessed_tree(xml_file)
+
+
+INDEX_TAGS = ["content", "params", "Members", "param", "remarks", "retval", "p"]
+
+
+def random_element(rng, depth=0):
+    elem = xml_correction.ET.Element(rng.choice(INDEX_TAGS))
+    if depth < 4:
+        for _ in range(rng.randint(0, 3)):
+            elem.append(random_element(rng, depth + 1))
+    return elem
+
+
+def test_indexed_tree_lookups_follow_replace_and_append():
+    rng = random.Random(7)
+    for _ in range(300):
+        tree = xml_correction.IndexedTree(random_element(rng))
+        for _ in range(8):
+            plain = xml_correction.ET.ElementTree(tree.getroot())
+            for tag in INDEX_TAGS:
+                assert xml_correction.find_node(tag, tree) is xml_correction.find_node(tag, plain)
+                assert xml_correction.find_all_nodes(tag, tree) == \
+                    xml_correction.find_all_nodes(tag, plain)
+            assert xml_correction.get_param_term(tree) == xml_correction.get_param_term(plain)
+            target = rng.choice(list(tree.iter()))
+            if rng.random() < 0.5:
+                tree.replace_node(target, random_element(rng, 1))
+            else:
+                tree.append_node(target, random_element(rng, 2))
+
+
+def test_fill_xml_matches_plain_trees(tmp_path, monkeypatch):
+    htm_file, xml_stub, original_xml = benchmark.write_sample_topic(str(tmp_path), 50)
+    indexed = xml_correction.serialize_tree(
+        xml_correction.fill_xml(htm_file, xml_stub, original_xml))
+
+    # the same fill, with every lookup walking the tree
+    tree_type = xml_correction.IndexedTree
+    monkeypatch.setattr(tree_type, "find_first", lambda self, tag: next(
+        (node for node in self.iter() if node.tag == tag), None))
+    monkeypatch.setattr(tree_type, "find_all", lambda self, tag: [
+        node for node in self.iter() if node.tag == tag])
+    monkeypatch.setattr(tree_type, "param_term", lambda self: next(
+        (node.tag.lower() for node in self.iter() if node.tag.lower() in xml_correction.P_TERMS),
+        None))
+    plain = xml_correction.serialize_tree(
+        xml_correction.fill_xml(htm_file, xml_stub, original_xml))
+    assert indexed == plain
+
+
+# tags that fill the random original documents below, and the sections fill_xml
+# transfers, which are put anywhere except inside each other
+FILLER_TAGS = ["params", "Members", "param", "p", "abstract", "syntax", "b", "section", "content",
+               "metadata"]
+TRANSFERRED_TAGS = ["remarks", "seealso", "info", "retval", "desc"]
+
+
+def random_xml(rng, depth, transferred=True):
+    if transferred and rng.random() < 0.25:
+        tag = rng.choice(TRANSFERRED_TAGS)
+        transferred = False
+    else:
+        tag = rng.choice(FILLER_TAGS)
+    children = "".join(random_xml(rng, depth + 1, transferred)
+                       for _ in range(rng.randint(0, 3 if depth < 4 else 0)))
+    return "<" + tag + ">" + rng.choice(["", "t", "\n"]) + children + "</" + tag + ">" + \
+        rng.choice(["", "\n", " tail "])
+
+
+def random_orig_xml(rng):
+    """an original document with the metadata and desc fill_xml needs, among
+    random elements"""
+    parts = [random_xml(rng, 1) for _ in range(rng.randint(0, 3))]
+    parts.append('<metadata msdnID="ff1"><tech value="k"/>' +
+                 (random_xml(rng, 2, False) if rng.random() < 0.5 else "") + "</metadata>\n")
+    if rng.random() < 0.3:
+        parts.append('<metadata msdnID="ff2"><tech value="j"/></metadata>')
+    parts.append("<content>" + "".join(random_xml(rng, 2) for _ in range(rng.randint(0, 3))) +
+                 "<desc>" + random_xml(rng, 3, False) + "</desc>\n" +
+                 "".join(random_xml(rng, 2) for _ in range(rng.randint(0, 3))) + "</content>\n")
+    rng.shuffle(parts)
+    return "<function>\n" + "".join(parts) + "</function>\n"
+
+
+@pytest.mark.parametrize("backend", sorted(xml_backend.BACKENDS))
+def test_streamed_orig_matches_whole_tree(tmp_path, backend):
+    rng = random.Random(14)
+    htm_file, xml_stub, original_xml = benchmark.write_sample_topic(str(tmp_path), 2)
+    for _ in range(300):
+        with open(original_xml, "w") as f:
+            f.write(random_orig_xml(rng))
+        converted = []
+        for stream_size in (0, xml_correction.ORIG_STREAM_SIZE):
+            try:
+                converted.append(xml_correction.serialize_tree(xml_correction.fill_xml(
+                    htm_file, xml_stub, original_xml, backend=backend, stream_size=stream_size)))
+            except Exception as err:
+                converted.append(type(err))
+        assert converted[0] == converted[1]
+
+
+def test_streamed_orig_keeps_only_what_is_used():
+    xml_bytes = b"<function><metadata><tech/></metadata><content>" + \
+        b"<section><p>filler</p></section>" * 100 + \
+        b"<desc><p>abstract</p></desc><syntax><params><param/></params>" + \
+        b"<retval><p>ok</p></retval></syntax><remarks><p>one</p></remarks>" + \
+        b"<remarks><p>two</p></remarks><example><info/></example></content></function>"
+    root = xml_correction.extract_orig_tree(xml_bytes, xml_backend.get_backend("etree"))
+    assert [elem.tag for elem in root.iter()] == [
+        "function", "metadata", "tech", "content", "desc", "p", "syntax", "params",
+        "retval", "p", "remarks", "p", "example", "info"]
+
+
+HTM_PIECES = ["<h2>Parameters</h2>", "<h2>Members</h2>", "<h2>", "</h2>", "\n", "<dt><i>Device</i>",
+              "<dt><b>Flags</b> [in]", "</dt>", "<dd>", "<p>text</p>", "</dd>", " ", "Parameters"]
+
+
+def test_htm_section_matches_old_extractor(tmp_path):
+    rng = random.Random(11)
+    htm_file = str(tmp_path / "page.htm")
+    for _ in range(2000):
+        page = "".join(rng.choice(HTM_PIECES) for _ in range(rng.randint(0, 30)))
+        with open(htm_file, "w") as f:
+            f.write(page)
+        for p_term in ("params", "members"):
+            try:
+                expected = benchmark.extract_params_from_htm_old(htm_file, p_term)
+            except AttributeError:
+                expected = None
+            heading = "<h2>" + ("Parameters" if p_term == "params" else "Members") + "</h2>"
+            sections = [xml_correction.read_htm_section(htm_file, heading, chunk_size)
+                        for chunk_size in (1, 3, 17, xml_correction.HTM_READ_SIZE)]
+            assert sections.count(sections[0]) == len(sections), page
+            assert (sections[0] is None) == (expected is None), page
+            if expected is None:
+                with pytest.raises(ValueError, match="page.htm"):
+                    xml_correction.extract_params_from_htm(htm_file, p_term)
+            else:
+                assert xml_correction.extract_params_from_htm(htm_file, p_term) == expected, page
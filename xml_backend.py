@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+parses and serializes the xml trees of a conversion. lxml is used when it's
+installed, and xml.etree.ElementTree otherwise. both take the bytes
+preprocess_xml returns, and give the same elements and byte for byte the
+same output, so a file converts the same whichever one is used. the one
+exception is a document where a section fill_xml transfers holds another
+one, e.g. a retval in the desc: lxml moves an element to its new place,
+where ElementTree leaves it in both
+
+"""
+
+import io
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+class ElementTreeBackend:
+    """the xml.etree.ElementTree backend"""
+
+    name = "etree"
+
+    def parse(self, xml_bytes):
+        """parses xml bytes, and returns the root element"""
+        return ET.fromstring(xml_bytes)
+
+    def iterparse(self, xml_bytes):
+        """parses xml bytes a chunk at a time, yielding ("start", element) and
+        ("end", element) events as the tree is built"""
+        return ET.iterparse(io.BytesIO(xml_bytes), events=("start", "end"))
+
+    def remove_child(self, parent, child):
+        """removes a child element from its parent. the child is looked for from
+        the end, where the one just parsed is"""
+        for i in range(len(parent) - 1, -1, -1):
+            if parent[i] is child:
+                del parent[i]
+                return
+
+    def set_root_attributes(self, tree, attributes):
+        """adds attributes to the root of an IndexedTree when it's serialized.
+        unlike other attributes, these can be namespace declarations"""
+        for attribute, val in attributes.items():
+            tree.getroot().set(attribute, val)
+
+    def tostring(self, tree):
+        """serializes the root of an IndexedTree to ascii bytes, without a prolog"""
+        return ET.tostring(tree.getroot())
+
+
+def escape_attribute(value):
+    """escapes an attribute value the way ElementTree does"""
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;") \
+        .replace("\"", "&quot;").replace("\r", "&#13;").replace("\n", "&#10;") \
+        .replace("\t", "&#09;")
+
+
+class LxmlBackend:
+    """the lxml backend. the tree and its serialization are done in C. lxml
+    doesn't allow namespace declarations as attributes, so those are kept on
+    the IndexedTree and added to the root's tag once it's serialized, and the
+    few places where lxml's output differs from ElementTree's are rewritten"""
+
+    name = "lxml"
+
+    def __init__(self):
+        # ElementTree drops comments and processing instructions when parsing
+        self._parser = etree.XMLParser(remove_comments=True, remove_pis=True)
+
+    def parse(self, xml_bytes):
+        """parses xml bytes, and returns the root element"""
+        return etree.fromstring(xml_bytes, self._parser)
+
+    def iterparse(self, xml_bytes):
+        """parses xml bytes a chunk at a time, yielding ("start", element) and
+        ("end", element) events as the tree is built"""
+        return etree.iterparse(io.BytesIO(xml_bytes), events=("start", "end"),
+                               remove_comments=True, remove_pis=True)
+
+    def remove_child(self, parent, child):
+        """removes a child element from its parent"""
+        parent.remove(child)
+
+    def set_root_attributes(self, tree, attributes):
+        """adds attributes to the root of an IndexedTree when it's serialized.
+        unlike other attributes, these can be namespace declarations"""
+        tree.root_attributes.update(attributes)
+
+    def tostring(self, tree):
+        """serializes the root of an IndexedTree to ascii bytes, without a prolog"""
+        xml_text = etree.tostring(tree.getroot(), encoding="unicode")
+        if tree.root_attributes:
+            # '>' is always escaped in text and attribute values, so the first
+            # one ends the root's start tag
+            tag_end = xml_text.index(">")
+            if xml_text[tag_end - 1] == "/":
+                tag_end -= 1
+            xml_text = xml_text[:tag_end] + "".join(
+                " " + attribute + "=\"" + escape_attribute(val) + "\""
+                for attribute, val in tree.root_attributes.items()) + xml_text[tag_end:]
+        # ElementTree writes empty elements as <tag />, and a tab in an attribute
+        # as &#09;. non-ascii characters become decimal references, as they do there
+        return xml_text.replace("/>", " />").replace("&#9;", "&#09;") \
+            .encode("ascii", "xmlcharrefreplace")
+
+
+BACKENDS = {"etree": ElementTreeBackend}
+if etree is not None:
+    BACKENDS["lxml"] = LxmlBackend
+# lxml when it's installed
+DEFAULT_BACKEND = "lxml" if etree is not None else "etree"
+
+_backends = {}
+
+def get_backend(name=None):
+    """returns the backend named in BACKENDS, or the default one. raises
+    ValueError if it isn't available, e.g. lxml when it isn't installed"""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError("xml backend not available: " + name +
+                         " (available: " + ", ".join(sorted(BACKENDS)) + ")")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
@@ -5,9 +5,30 @@ fixes xml files that have a page type mismatch
 """
 
 import xml.etree.ElementTree as ET
+import copy
 import re
 import os
 import subprocess
+import argparse
+import functools
+import io
+import json
+import tarfile
+import time
+import zipfile
+import collections
+import multiprocessing
+import input_cache
+import instrumentation
+import itertools
+import manifest
+import path_index
+import schema_validation
+import xml_backend
+import sharding
+import shlex
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # the terms found in xml files to specify API parameters
 P_TERMS = ["members", "parameters", "params", "constants"]
@@ -17,56 +38,181 @@ sd_loc = "C:\\Users\\aahi\\Sd" # source depot location
 stub_loc = "//ANDKI_BOOK\\Output\\StubFilesOutput"
 
 
+# the rewrites preprocess_xml makes, in the order it makes them: xml declarations
+# are removed, then tags carrying schema or namespace information are reduced to
+# their name. non-ascii characters are stripped after these two, and a tag with a
+# namespace on a line by itself is only reduced to its name after that
+DECLARATION_PATTERN = r'<\?xml[^>]+>\r?\n'
+NAMESPACE_PATTERN = r'<(\w+) (?:xsi:schemaLocation|xmlns)[^>]+>'
+NAMESPACE_LINE_PATTERN = r'<(\w+)\sxmlns=[^\r\n]+>\r?\n'
+# files are matched as bytes, except non-ascii ones, which are decoded for the
+# first two rewrites so tag names are matched as they were in the text version
+DECLARATION_REGEX = re.compile(DECLARATION_PATTERN)
+DECLARATION_BYTES_REGEX = re.compile(DECLARATION_PATTERN.encode("ascii"))
+NAMESPACE_REGEX = re.compile(NAMESPACE_PATTERN)
+NAMESPACE_BYTES_REGEX = re.compile(NAMESPACE_PATTERN.encode("ascii"))
+NAMESPACE_LINE_BYTES_REGEX = re.compile(NAMESPACE_LINE_PATTERN.encode("ascii"))
+
+# an input file read ahead of its conversion: its path, and its bytes, or the
+# OSError reading it raised, which is raised again when the file is used
+InputFile = collections.namedtuple("InputFile", ["path", "data", "error"])
+
+def read_input_file(path):
+    """reads a file into an InputFile"""
+    try:
+        with open(path, 'rb') as f:
+            return InputFile(path, f.read(), None)
+    except OSError as err:
+        return InputFile(path, None, err)
+
+def get_input_path(input_file):
+    """the path of an input file, given as a path or an InputFile"""
+    return input_file.path if isinstance(input_file, InputFile) else input_file
+
+def read_input_bytes(input_file):
+    """the bytes of an input file, given as a path or an InputFile. raises
+    the error reading an InputFile hit, if it hit one"""
+    if isinstance(input_file, InputFile):
+        if input_file.error is not None:
+            raise input_file.error
+        return input_file.data
+    with open(input_file, 'rb') as f:
+        return f.read()
+
+def open_input_text(input_file):
+    """opens an input file, given as a path or an InputFile, in text mode"""
+    if isinstance(input_file, InputFile):
+        # the same encoding and newline handling as open()
+        return io.TextIOWrapper(io.BytesIO(read_input_bytes(input_file)))
+    return open(input_file)
+
 def preprocess_xml(xml_file):
     """take an xml file, read the contents, and prepare it for processing by
     ElementTree. Most importantly, this function removes namespaces from the xml,
-    which hinder functionality"""
-
-    with open(xml_file, 'r', encoding="utf-8") as f:
-        xml_text = f.read()
-    # strip xml declarations (lines starting with <?xml) from the xml string
-    xml_text = re.sub(r'\<\?xml[^\>]+\>\n', "", xml_text)
-    # remove schema and namespace information, which can cause issues when the
-    # xml is processed
-    xml_text = re.sub(r'<(\w+) (?:xsi:schemaLocation|xmlns)[^>]+>', r"<\1>", xml_text)
-    # strip all non-unicode characters
-    xml_text = re.sub(r'[^\x00-\x7F]+', '', xml_text)
+    which hinder functionality. The file is read and returned as bytes. xml_file
+    can be a path, or an InputFile that's already been read"""
+
+    xml_bytes = read_input_bytes(xml_file)
+    # strip xml declarations (lines starting with <?xml), and remove schema and
+    # namespace information, which can cause issues when the xml is processed.
+    # ascii files, the usual case, are never decoded
+    if xml_bytes.isascii():
+        xml_bytes = DECLARATION_BYTES_REGEX.sub(b"", xml_bytes)
+        xml_bytes = NAMESPACE_BYTES_REGEX.sub(rb"<\1>", xml_bytes)
+    else:
+        xml_text = DECLARATION_REGEX.sub("", xml_bytes.decode("utf-8"))
+        xml_text = NAMESPACE_REGEX.sub(r"<\1>", xml_text)
+        # strip all non-ascii characters
+        xml_bytes = xml_text.encode("ascii", "ignore")
     # remove namespace for easier parsing
-    xml_text = re.sub(r'\<(\w+)\sxmlns=.+\>\n', r"<\1>", xml_text)
+    return NAMESPACE_LINE_BYTES_REGEX.sub(rb"<\1>", xml_bytes)
+
+class IndexedTree(ET.ElementTree):
+    """an ElementTree that remembers the result of its lookups by tag, so repeated
+    lookups don't walk the tree again. Lookups use ElementTree's own tag search,
+    which runs in C, and a first match stops as soon as it's found. replace_node()
+    and append_node() throw everything remembered away. Changes made directly to
+    the elements are not seen. The elements can come from any xml_backend, which
+    the tree is serialized with"""
+
+    def __init__(self, element=None, file=None, backend=None):
+        ET.ElementTree.__init__(self, element, file)
+        self.backend = backend or xml_backend.get_backend("etree")
+        # attributes the backend adds to the root when it's serialized
+        self.root_attributes = {}
+        self._first = {}
+        self._all = {}
+        self._param_term = ()
+
+    def find_first(self, tag):
+        """returns the first element with the tag, or None"""
+        if tag in self._all:
+            elems = self._all[tag]
+            return elems[0] if elems else None
+        if tag not in self._first:
+            self._first[tag] = next(self.getroot().iter(tag), None)
+        return self._first[tag]
+
+    def find_all(self, tag):
+        """returns all elements with the tag, in document order"""
+        if tag not in self._all:
+            self._all[tag] = list(self.getroot().iter(tag))
+        return list(self._all[tag])
 
-    return xml_text
+    def param_term(self):
+        """get_param_term() for this tree"""
+        if self._param_term == ():
+            self._param_term = None
+            for node in self.getroot().iter():
+                tag = node.tag.lower()
+                if tag in P_TERMS:
+                    self._param_term = tag
+                    break
+        return self._param_term
+
+    def _changed(self):
+        self._first.clear()
+        self._all.clear()
+        self._param_term = ()
+
+    def replace_node(self, oldtree, newtree):
+        """replace() for an element of this tree"""
+        replace(oldtree, newtree)
+        self._changed()
+
+    def append_node(self, parent, child):
+        """appends child to an element of this tree"""
+        parent.append(child)
+        self._changed()
 
 def replace(oldtree, newtree):
     """clears an xml subtree and replaces it with the new subtree.
-    Note that the root of both subtrees should be the same"""
+    Note that the root of both subtrees should be the same, and come from
+    the same xml_backend. with lxml, the children are moved out of newtree"""
     oldtree.clear()
     oldtree.text = newtree.text
     oldtree.tail = newtree.tail
     for elem in list(newtree):
         oldtree.append(elem)
 
+def has_children(node):
+    """checks that a node was found and has child elements, which is what testing
+    the node itself used to mean. ElementTree and lxml deprecate that test, and
+    lxml will make every element true"""
+    return node is not None and len(node) > 0
+
 def transfer_single_node(stub_tree, orig_tree, tag, default_loc):
     """transfers the content from a single node in orig_tree to stub_tree,
     along with all child nodes. if the node doesn't exist in orig_tree,
     it will be placed in the default location."""
     stub_node = find_node(tag, stub_tree)
     orig_node = find_node(tag, orig_tree)
-    if orig_node:
+    if has_children(orig_node):
         # if the seealso section exists, replace the stub one, or place it in the xml
-        if stub_node:
-            replace(stub_node, orig_node)
+        if has_children(stub_node):
+            stub_tree.replace_node(stub_node, orig_node)
         else:
-            stub_tree.getroot().find(default_loc).append(orig_node)
+            stub_tree.append_node(stub_tree.getroot().find(default_loc), orig_node)
 
 def find_node(node_name, tree):
     """ returns a specific node from the xml tree"""
+    if isinstance(tree, IndexedTree):
+        return tree.find_first(node_name)
     for node in tree.iter():
         if node.tag == node_name:
             return node
     return None
 
+def find_all_nodes(node_name, tree):
+    """ returns all nodes with a specific tag from the xml tree"""
+    if isinstance(tree, IndexedTree):
+        return tree.find_all(node_name)
+    return list(tree.getroot().iter(node_name))
+
 def get_param_term(tree):
     "gets the xml tag for parameters"
+    if isinstance(tree, IndexedTree):
+        return tree.param_term()
     for node in tree.getroot().iter():
         tag = node.tag.lower()
         if tag in P_TERMS:
@@ -78,12 +224,12 @@ def transfer_retval(stub_tree, orig_tree, pagetype):
     real_retval = find_node("retval", orig_tree)
     stub_retval = find_node("retval", stub_tree)
     param_val = get_param_term(stub_tree)
-    if real_retval:
-        if not stub_retval:
+    if has_children(real_retval):
+        if not has_children(stub_retval):
             ret = stub_tree.getroot().find("content/syntax/"+param_val)
-            ret.append(real_retval)
+            stub_tree.append_node(ret, real_retval)
         else:
-            replace(stub_retval, real_retval)
+            stub_tree.replace_node(stub_retval, real_retval)
 
 def transfer_metadata(stub_tree, orig_tree):
     """get the metadata info from the elementTree (ET) generated from the original xml file
@@ -120,66 +266,182 @@ def transfer_metadata_old(stub_tree, original_tree, page_type):
             stub_metadata = orig_metadata
             return None
 
-def fill_xml(htm_file, xml_stub, original_xml):
+# original documents larger than this many bytes, once preprocessed, are parsed
+# with extract_orig_tree instead of being parsed whole
+ORIG_STREAM_SIZE = 1024 * 1024
+# the tags fill_xml looks up the first of anywhere in the original document
+ORIG_FIRST_TAGS = ("remarks", "seealso", "info", "retval")
+
+def extract_orig_tree(xml_bytes, backend):
+    """parses an original document with iterparse, keeping only what fill_xml looks
+    up in it: each metadata under the root, each desc of a content under the root,
+    the first remarks, seealso, info and retval, and the first param term, along
+    with the elements that hold them. every other element is dropped once it's
+    parsed, so the tree stays small however large the document is. returns the root"""
+    root = None
+    # the open elements, and whether each one stays: "whole" for the elements
+    # that are kept along with everything in them, "holds" for the others that
+    # are kept, and None for ones that are dropped when they end
+    stack = []
+    seen = set()
+    param_term = None
+    # dropped elements are only removed from their parent at the next event,
+    # once the text after them is parsed, so lxml doesn't move it elsewhere
+    dropped = []
+    for event, elem in backend.iterparse(xml_bytes):
+        while dropped:
+            backend.remove_child(*dropped.pop())
+        if event == "start":
+            tag = elem.tag
+            depth = len(stack)
+            inside = depth > 0 and stack[-1][1] == "whole"
+            state = None
+            if tag in ORIG_FIRST_TAGS and tag not in seen:
+                seen.add(tag)
+                state = "whole"
+            if param_term is None and tag.lower() in P_TERMS:
+                param_term = tag
+                state = state or "holds"
+            if inside or (depth == 1 and tag == "metadata") or \
+                    (depth == 2 and tag == "desc" and stack[1][0].tag == "content"):
+                state = "whole"
+            if depth == 0:
+                root = elem
+                state = "holds"
+            stack.append([elem, state])
+        else:
+            elem, state = stack.pop()
+            if stack:
+                if state is None:
+                    dropped.append((stack[-1][0], elem))
+                elif stack[-1][1] is None:
+                    stack[-1][1] = "holds"
+    return root
+
+# the schema information added to the root of a filled stub, to make the xml
+# render as wdcml
+SCHEMA_ATTRIBUTES = {
+    "xsi:schemaLocation":"http://microsoft.com/wdcml ../../BuildX/Schema/xsd/wdcml.xsd",
+    "xmlns":"http://microsoft.com/wdcml",
+    "xmlns:xsi":"http://www.w3.org/2001/XMLSchema-instance",
+    "xmlns:msxsl": "urn:schemas-microsoft-com:xslt",
+    "xmlns:x":"http://www.w3.org/1999/xhtml",
+    "xmlns:mssdk":"winsdk",
+    "xmlns:script":"urn:script",
+    "xmlns:build":"urn:build",
+    "xmlns:MSHelp":"http://msdn.microsoft.com/mshelp",
+    "xmlns:dx":"http://ddue.schemas.microsoft.com/authoring/2003/5",
+    "xmlns:xlink":"http://www.w3.org/1999/xlink"
+}
+
+def load_tree(xml_file, name, backend, trace, cache=None, stream_size=None):
+    """preprocesses and parses a stub ("stub") or original ("orig") document,
+    timing it as the preprocess_ and parse_ stages of name. an original larger
+    than stream_size bytes is parsed with extract_orig_tree. if cache is an
+    input_cache.InputCache, the tree is looked up by the file's content, and a
+    copy of it is returned, so the cached one is never changed"""
+    if cache is None:
+        with trace.stage("preprocess_" + name):
+            xml_bytes = preprocess_xml(xml_file)
+        with trace.stage("parse_" + name):
+            if stream_size is not None and len(xml_bytes) > stream_size:
+                return extract_orig_tree(xml_bytes, backend)
+            return backend.parse(xml_bytes)
+    with trace.stage("preprocess_" + name):
+        digest = input_cache.get_digest(read_input_bytes(xml_file))
+        key = (backend.name, stream_size, digest)
+        root = cache.get(name, key, trace)
+        if root is None:
+            xml_bytes = cache.load("preprocessed", (digest,), trace)
+            if xml_bytes is None:
+                xml_bytes = preprocess_xml(xml_file)
+                cache.store("preprocessed", (digest,), xml_bytes)
+    with trace.stage("parse_" + name):
+        if root is None:
+            if stream_size is not None and len(xml_bytes) > stream_size:
+                root = extract_orig_tree(xml_bytes, backend)
+            else:
+                root = backend.parse(xml_bytes)
+            if not cache.put(name, key, root, len(xml_bytes) * input_cache.TREE_SIZE_FACTOR):
+                return root
+        return copy.deepcopy(root)
+
+def extract_params(htm_file, p_term, cache=None, trace=None):
+    """extract_params_from_htm, looked up by the htm file's content in cache, an
+    input_cache.InputCache, if it's given. a copy of the cached params is returned"""
+    if cache is None:
+        return extract_params_from_htm(htm_file, p_term)
+    htm_file = InputFile(get_input_path(htm_file), read_input_bytes(htm_file), None)
+    key = (p_term, input_cache.get_digest(htm_file.data))
+    params = cache.get("params", key, trace)
+    if params is None:
+        stored = cache.load("params", key, trace)
+        if stored is not None:
+            params = json.loads(stored.decode("utf-8"))
+        else:
+            params = extract_params_from_htm(htm_file, p_term)
+            cache.store("params", key, json.dumps(params).encode("utf-8"))
+        cache.put("params", key, params, sum(len(name) + len(text) for name, text in params.items()))
+    return dict(params)
+
+def fill_xml(htm_file, xml_stub, original_xml, trace=None, backend=None,
+             stream_size=ORIG_STREAM_SIZE, cache=None):
     """starts the file correction process
-    takes an htm file and extracts its text to the xml stub file"""
+    takes an htm file and extracts its text to the xml stub file.
+    each step is timed as a stage of trace, an instrumentation.RowTrace, if it's given.
+    the files are parsed with the xml_backend named by backend, by default lxml when
+    it's installed. an original document larger than stream_size bytes only has the
+    parts that are used kept, with extract_orig_tree. each file can be a path, or an
+    InputFile that's already been read, e.g. by an InputPrefetcher. if cache is an
+    input_cache.InputCache, the trees and params made from files with the same
+    content as earlier ones are copied from it"""
+    if trace is None:
+        trace = instrumentation.RowTrace(None)
+    backend = xml_backend.get_backend(backend)
 
     # preprocess xml files to remove namespaces, amongst other things
-    # note that a full ET tree is created after parsing the xml passed in a string
-    stub_tree = ET.ElementTree(
-        ET.fromstring(
-            preprocess_xml(xml_stub)))
-
-    orig_tree = ET.ElementTree(
-        ET.fromstring(
-            preprocess_xml(
-                original_xml)))
+    # note that a full ET tree is created after parsing the xml passed in a string,
+    # and indexed by tag for the lookups made below
+    stub_tree = IndexedTree(load_tree(xml_stub, "stub", backend, trace, cache), backend=backend)
+    orig_tree = IndexedTree(load_tree(original_xml, "orig", backend, trace, cache, stream_size),
+                            backend=backend)
 
     pagetype = stub_tree.getroot().tag # the stub xml file contains the correct pagetype
-    transfer_metadata(stub_tree, orig_tree) # place original metadata in stub file
+    with trace.stage("transfer_metadata"):
+        transfer_metadata(stub_tree, orig_tree) # place original metadata in stub file
 
     # extract htm file parameters and associate them with the proper text as a dictionary
-    p_term = get_param_term(orig_tree)
-    param_dict = extract_params_from_htm(htm_file, p_term)
+    with trace.stage("extract_params"):
+        p_term = get_param_term(orig_tree)
+        param_dict = extract_params(htm_file, p_term, cache, trace)
     if pagetype != "ioctl":
-        add_params_to_stub(pagetype, param_dict, stub_tree)
+        with trace.stage("add_params"):
+            add_params_to_stub(pagetype, param_dict, stub_tree, trace)
     # add abstract
-    add_abstract_to_stub(stub_tree, orig_tree)
+    with trace.stage("add_abstract"):
+        add_abstract_to_stub(stub_tree, orig_tree)
     # add info tag
     #add_info_to_stub(stub_tree, orig_tree)
 
     # add remarks, seealso, and info
-    transfer_single_node(stub_tree, orig_tree, "remarks", "content")
-    transfer_single_node(stub_tree, orig_tree, "seealso", "content")
-    transfer_single_node(stub_tree, orig_tree, "info", "content")
+    for tag in ("remarks", "seealso", "info"):
+        with trace.stage("transfer_" + tag):
+            transfer_single_node(stub_tree, orig_tree, tag, "content")
 
     if pagetype != "ioctl":
-        transfer_retval(stub_tree, orig_tree, pagetype)
+        with trace.stage("transfer_retval"):
+            transfer_retval(stub_tree, orig_tree, pagetype)
 
     # add schema information to make the xml render as wdcml
-    schema_info = {
-        "xsi:schemaLocation":"http://microsoft.com/wdcml ../../BuildX/Schema/xsd/wdcml.xsd",
-        "xmlns":"http://microsoft.com/wdcml",
-        "xmlns:xsi":"http://www.w3.org/2001/XMLSchema-instance",
-        "xmlns:msxsl": "urn:schemas-microsoft-com:xslt",
-        "xmlns:x":"http://www.w3.org/1999/xhtml",
-        "xmlns:mssdk":"winsdk",
-        "xmlns:script":"urn:script",
-        "xmlns:build":"urn:build",
-        "xmlns:MSHelp":"http://msdn.microsoft.com/mshelp",
-        "xmlns:dx":"http://ddue.schemas.microsoft.com/authoring/2003/5",
-        "xmlns:xlink":"http://www.w3.org/1999/xlink"
-    }
-    for attribute, val in schema_info.items():
-        stub_tree.getroot().set(attribute, val)
+    backend.set_root_attributes(stub_tree, SCHEMA_ATTRIBUTES)
     return stub_tree
 
 def add_abstract_to_stub(stub_tree, orig_tree):
     real_abstract = orig_tree.getroot().find("content/desc/p/abstract")
-    if not real_abstract:
+    if not has_children(real_abstract):
         real_abstract = orig_tree.getroot().find("content/desc")
     stub_abstract_loc = stub_tree.getroot().find("content").find("desc")
-    replace(stub_abstract_loc, real_abstract)
+    stub_tree.replace_node(stub_abstract_loc, real_abstract)
 
 def add_info_to_stub(stub_tree, orig_tree):
     """adds original info to the stub xml tree"""
@@ -188,8 +450,10 @@ def add_info_to_stub(stub_tree, orig_tree):
         for stub_metadata in stub_tree.iter('info'):
             stub_metadata = orig_metadata
 
-def add_params_to_stub(pagetype, param_fields, stub_tree):
-    """adds the parameter text scraped from the htm file, and appends it to the stub tree"""
+def add_params_to_stub(pagetype, param_fields, stub_tree, trace=None):
+    """adds the parameter text scraped from the htm file, and appends it to the stub tree.
+    params of the stub that aren't in the htm file are counted as "param_not_found" in
+    trace, if it's given"""
 
     # maps the api type to the param section
     # (which is most likely named differently depending on api type)
@@ -199,14 +463,18 @@ def add_params_to_stub(pagetype, param_fields, stub_tree):
     # param terms don't occur in pluralized tag names
     if param_location[-1] == "s":
         param_location = param_location[:-1]
-    for param_element in stub_tree.getroot().iter(param_location):
+    for param_element in find_all_nodes(param_location, stub_tree):
         if param_element.tag == param_location:
-            try:
-                param_name = param_element.find("name").text
-                param_text = param_element.find("desc")
-                param_text.text = param_fields[param_name]
-            except:
+            name = param_element.find("name")
+            param_name = name.text if name is not None else None
+            param_text = param_element.find("desc")
+            if param_text is None or param_name not in param_fields:
                 print(param_name, ": NOT FOUND in FILE")
+                if trace is not None:
+                    trace.count("param_not_found")
+                continue
+            # empty text is left out, as ElementTree would when it's serialized
+            param_text.text = param_fields[param_name] or None
 
 def alter_html_tags(html_string):
     """converts or removes html tags from text"""
@@ -222,6 +490,37 @@ def alter_html_tags(html_string):
 
     return converted
 
+# characters read from an htm file at a time, while looking for the params section
+HTM_READ_SIZE = 64 * 1024
+# a param name and its text, from the params section of an htm file
+HTM_PARAM_PATTERN = re.compile(r'<dt>(?:<\w+?>)(\w+).*?</dt>\s*<dd>(.+?)</dd>')
+
+def read_htm_section(htm_file, heading, chunk_size=HTM_READ_SIZE):
+    """reads an htm file, with newlines removed, until the section starting at
+    heading ends. returns the section, from heading up to and including the next
+    <h2>, or None if there isn't one. the rest of the file is never read.
+    htm_file can be a path, or an InputFile that's already been read"""
+    buffered = ""
+    found = False
+    with open_input_text(htm_file) as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            buffered += chunk.replace('\n', '')
+            if not found:
+                start = buffered.find(heading)
+                if start < 0:
+                    # only keep the text that could be the start of the heading
+                    buffered = buffered[max(0, len(buffered) - len(heading) + 1):]
+                    continue
+                found = True
+                buffered = buffered[start:]
+                # the section must hold at least one character
+                search_from = len(heading) + 1
+            end = buffered.find("<h2>", search_from)
+            if end >= 0:
+                return buffered[:end + len("<h2>")]
+            search_from = max(search_from, len(buffered) - len("<h2>") + 1)
+    return None
+
 def extract_params_from_htm(htm_file, p_term):
     """iterates through an html file, looking for an h2 tag that signifies
     where the params are listed. These params and their associated text
@@ -233,66 +532,70 @@ def extract_params_from_htm(htm_file, p_term):
     else:
         p_term = p_term[0].upper() + p_term[1:]
     # find section of text containing param info
-    htm_lines = open(htm_file).read().replace('\n', '')
-    re_term = '<h2>' + p_term + '</h2>(.+?)<h2>'
-    param_search_str = re.compile(re_term) # used to find parameters section'
-    param_html = param_search_str.search(htm_lines).group()
+    param_html = read_htm_section(htm_file, '<h2>' + p_term + '</h2>')
+    if param_html is None:
+        raise ValueError(p_term + " section not found in htm file: " + get_input_path(htm_file))
 
     # get param names and associated info
     ##param_name_list = re.findall(r'<dt>(.+?)</dt>\s*<dd>(.+?)</dd>', param_html)
-    param_name_list = re.findall(r'<dt>(?:<\w+?>)(\w+).*?</dt>\s*<dd>(.+?)</dd>', param_html)
+    param_name_list = HTM_PARAM_PATTERN.findall(param_html)
     for param in param_name_list:
         param_title = param[0].strip()
         param_text = alter_html_tags(param[1].strip())
         text_dict[param_title] = param_text
     return text_dict
 
+def get_conversion_info(record):
+    """the info needed to convert the file of a manifest record"""
+    return {
+        "title":record.title,
+        "header":record.header_in_md,
+        "project":record.project,
+        "htm_location":record.xml_location,
+        "md_location":record.md_location,
+        "owner":record.owner
+    }
+
+def iter_conversion_rows(csv_loc):
+    """yields the info needed to convert each file in a "type mismatch" csv
+    file, as the file is read"""
+    for record in manifest.read_manifest(csv_loc):
+        yield get_conversion_info(record)
+
 def get_file_mapping(csv_loc):
     """looks through csv "type mismatch" file to generate a
-    map of files that need correcting. Returns a dict of projects
+    map of files that need correcting. Returns a dict of titles
     and their files, with relevant info"""
     file_dict = {}
-    header_line = True
-    with open(csv_loc, "r") as f:
-        for line in f:
-            # header in csv should be skipped
-            if not header_line:
-                # use the regex to split commas that are not inside other brackets
-                line_l = re.split(r",(?![^\[]*?[^\]]\])", line) #(r",\s*(?![^\[\]]*\))",line)
-                title = line_l[0]
-                #print(title)
-                header = line_l[1]
-                project = line_l[5]
-                htm_location = line_l[13]
-                stub_location = line_l[14]
-                owner = line_l[15]
-                file_dict[title] = {
-                    "title":title,
-                    "header":header,
-                    "project":project,
-                    "htm_location":htm_location,
-                    "md_location":stub_location,
-                    "owner":owner
-                }
-            else:
-                header_line = False
+    for conversion_info in iter_conversion_rows(csv_loc):
+        file_dict[conversion_info["title"]] = conversion_info
     return file_dict
 
-def get_filepaths(file_info, stub_loc, sd_loc):
+# the command that builds the html for a project. it's run from the project
+# folder, and can be replaced, e.g. with a stand-in script when testing on Linux
+HTML_BUILD_COMMAND = [
+    "C:\\WINDOWS\\system32\\WindowsPowerShell\\v1.0\\powershell.exe ",
+    # set the execution policy to allow the script to be run
+    '-ExecutionPolicy', 'Unrestricted', " & ", "CbX msdn hxs_msdn"]
+
+def generate_project_html(project_path, build_command=None):
+    """ runs an html build process for a project"""
+    call = build_command or HTML_BUILD_COMMAND
+    # change the working directory to the project path before execution
+    return_code = subprocess.call(call, cwd=project_path)
+    return return_code
+
+def get_htm_build_path(project, sd_loc):
+    """gets the folder that a project's html is built to"""
+    return os.path.join(sd_loc, project, "build", "HxS_MSDN")
+
+def get_filepaths(file_info, stub_loc, sd_loc, build=True, index=None):
     """gets the three filepaths needed for conversion:
-    the original xml, the stub xml, and the htm file"""
-
-    def generate_project_html(project_path):
-        """ runs an html build process for a project"""
-
-        powershell = "C:\\WINDOWS\\system32\\WindowsPowerShell\\v1.0\\powershell.exe "
-        cbx_command = "CbX msdn hxs_msdn"
-        # set the execution policy to allow the script to be run
-        # set the execution policy to allow the script to be run
-        call = [powershell, '-ExecutionPolicy', 'Unrestricted', " & ", cbx_command]
-        # change the working directory to the project path before execution
-        return_code = subprocess.call(call, cwd=project_path)
-        return return_code
+    the original xml, the stub xml, and the htm file.
+    if build is False, the project html is not built when it's missing.
+    if index is a path_index.PathIndex, the paths of files that exist are
+    given the case they have on disk"""
+
     project = file_info["project"]
     # get the stub location from md_location
     stub_filepath = file_info["md_location"] \
@@ -307,76 +610,678 @@ def get_filepaths(file_info, stub_loc, sd_loc):
     orig_filepath = os.path.join(sd_loc, project, project, orig_filename) + ".xml"
 
     # get the htm file, building the project if necessary
-    htm_build_path = os.path.join(sd_loc, project, "build", "HxS_MSDN")
+    htm_build_path = get_htm_build_path(project, sd_loc)
     htm_filepath = os.path.join(htm_build_path, file_info["htm_location"])
 
-    if not os.path.exists(htm_build_path):
+    if build and not os.path.exists(htm_build_path):
         ret_code = generate_project_html(os.path.join(sd_loc, project))
         # retcode == 1 signifies a build error
         assert ret_code != 1, ("build error for project: " + htm_build_path)
 
+    if index is not None:
+        return tuple(index.resolve(path) or path
+                     for path in (orig_filepath, stub_filepath, htm_filepath))
     return (orig_filepath, stub_filepath, htm_filepath)
 
+def get_missing_input(file_info, stub_loc, sd_loc, index):
+    """looks up a row's input files in a path_index.PathIndex, without opening
+    them. returns the FileNotFoundError the first one fill_xml would find missing
+    raises, or None. the htm file of a project whose html hasn't been built
+    isn't looked for, since the build writes it"""
+    orig, stub, htm = get_filepaths(file_info, stub_loc, sd_loc, build=False)
+    paths = [stub, orig]
+    if index.resolve(get_htm_build_path(file_info["project"], sd_loc)) is not None:
+        paths.append(htm)
+    for path in paths:
+        if index.resolve(path) is None:
+            return path_index.get_missing_error(path)
+    return None
+
+def serialize_tree(tree):
+    """ serialize an IndexedTree, including the xml versioning info, to bytes, with the
+    backend it was parsed with. The prolog uses the platform line ending, the same as
+    a text mode write """
+    prolog = '<?xml version="1.0" encoding="utf-8"?>' + os.linesep + \
+        '<?xml-stylesheet type="text/xsl" href="../../BuildX/Script2/preview.xslt"?>' + os.linesep
+    return prolog.encode("utf-8") + tree.backend.tostring(tree)
+
+def get_output_filename(filename):
+    """ gets the name of the output file for a title """
+    #change filename if illegal characters exist
+    return filename.lower().replace("::", "_") + ".xml"
+
+def write_atomic(path, data):
+    """ writes bytes to a file, unless the file already holds exactly those bytes.
+    the bytes go to a temporary file that replaces the file once it's complete,
+    so a crash never leaves a half written file. returns False if the file
+    was unchanged """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+def write_serialized(xml_bytes, filename, output_path):
+    """ write already serialized xml to the output file. returns False
+    if the file already held the same xml """
+    return write_atomic(os.path.join(output_path, get_output_filename(filename)), xml_bytes)
+
 def write_tree(tree, filename, output_path):
     """ write ET xml tree to output file """
-    #change filename if illegal characters exist
-    fname = filename.lower().replace("::", "_")
-    #write xml versioning info
-    with open(os.path.join(output_path, fname +".xml"), 'w') as f:
+    return write_serialized(serialize_tree(tree), filename, output_path)
 
-        f.writelines('<?xml version="1.0" encoding="utf-8"?>\n')
-        f.writelines('<?xml-stylesheet type="text/xsl" href="../../BuildX/Script2/preview.xslt"?>\n')
-    #write actual tree content
-    with open(os.path.join(output_path, fname +".xml"), 'ab') as f:
-        tree.write(f)
+class OutputArchive:
+    """ writes output files into a single zip or tar archive, picked by the
+    extension of the archive's path: .zip, .tar, .tar.gz or .tgz. The
+    archive is written to a temporary file, which replaces the archive when
+    it's closed, so a run that fails never leaves a half written archive """
 
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.temp_path = archive_path + "." + str(os.getpid()) + ".tmp"
+        lower_path = archive_path.lower()
+        if lower_path.endswith(".zip"):
+            self._zip = zipfile.ZipFile(self.temp_path, 'w', zipfile.ZIP_DEFLATED)
+            self._tar = None
+        elif lower_path.endswith((".tar.gz", ".tgz")):
+            self._zip = None
+            self._tar = tarfile.open(self.temp_path, 'w:gz')
+        elif lower_path.endswith(".tar"):
+            self._zip = None
+            self._tar = tarfile.open(self.temp_path, 'w')
+        else:
+            raise ValueError("output archive must be a .zip, .tar, .tar.gz or .tgz file: " +
+                             archive_path)
+
+    def write(self, name, data):
+        """ adds a file to the archive. name is its path in the archive """
+        name = name.replace(os.sep, "/")
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self, keep=True):
+        """ finishes the archive, and replaces the archive with it if keep is True """
+        (self._zip or self._tar).close()
+        if keep:
+            os.replace(self.temp_path, self.archive_path)
+        else:
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(keep=exc_type is None)
+
+def get_output_dir(conversion_info, base_output_dir):
+    """ gets the output folder for a converted file: one folder per owner and project """
+    owner = conversion_info["owner"].replace("REDMOND\\", "").replace("\n", "")
+    return os.path.join(base_output_dir, owner, conversion_info["project"])
+
+def get_failure_str(conversion_info, failure):
+    """ formats a file that couldn't be converted for failed_files.txt,
+    along with the worker that hit the failure and the exception """
+    worker, error = failure
+    return "title: " +conversion_info["title"] + "\n" + \
+        "project: " + conversion_info["project"] + "\n" + \
+        "owner: " + conversion_info["owner"].rstrip("\n") + "\n" + \
+        "worker: " + worker + "\n" + \
+        "error: " + error + "\n"
+
+def describe_error(err):
+    """ short, picklable description of an exception """
+    return type(err).__name__ + ": " + str(err)
+
+def _build_project(project_path, build_command):
+    """runs generate_project_html on a build thread. returns the name of the
+    thread, the return code, the exception if it raised one, and the seconds it took"""
+    worker = threading.current_thread().name
+    start = time.perf_counter()
+    try:
+        return worker, generate_project_html(project_path, build_command), None, \
+            time.perf_counter() - start
+    except Exception as err:
+        return worker, None, err, time.perf_counter() - start
+
+def start_build(project, sd_loc, build_pool, build_command=None):
+    """starts a build of a project's html on build_pool if it hasn't been
+    built, and returns the future of the build. returns None if it's built"""
+    if os.path.exists(get_htm_build_path(project, sd_loc)):
+        return None
+    print("building html for: ", project)
+    return build_pool.submit(_build_project, os.path.join(sd_loc, project), build_command)
+
+def get_build_failure(build, project, sd_loc):
+    """returns the failure to record for the rows of a project if its finished
+    build failed, and the instrumentation.get_error_info of its error, or
+    (None, None). the failure names the build thread either way"""
+    worker, ret_code, error, _ = build.result()
+    # retcode == 1 signifies a build error
+    if error is None and ret_code == 1:
+        error = AssertionError("build error for project: " + get_htm_build_path(project, sd_loc))
+    if error is None:
+        return None, None
+    return (worker, describe_error(error)), instrumentation.get_error_info(error)
+
+def convert_row(conversion_info, stub_loc, sd_loc, build=True, trace=None, backend=None,
+                stream_size=ORIG_STREAM_SIZE, inputs=None, paths=None, schema_loc=None, cache=None):
+    """converts a single row of the file mapping, in whichever process runs it.
+    returns a tuple of (conversion_info, serialized xml, failure, trace). On failure the
+    serialized xml is None, and failure is a tuple of the worker name and the exception.
+    trace is an instrumentation.RowTrace with the time of each stage, and the error
+    if there was one; a new one is made if it isn't given. backend and stream_size
+    are passed to fill_xml. inputs is a future holding the row's InputFiles, from
+    an InputPrefetcher, when they've been read ahead; otherwise they're read here,
+    from paths, if it's given, or the paths get_filepaths gives. if schema_loc is
+    given, the serialized xml is checked against that schema, and a row that isn't
+    valid fails with schema_validation.SchemaValidationError. cache is passed to
+    fill_xml"""
+    print("converting: ", conversion_info["title"])
+    if trace is None:
+        trace = instrumentation.RowTrace(conversion_info["title"])
+    trace.worker = multiprocessing.current_process().name
+    try:
+        if inputs is not None:
+            # only the time spent waiting for a read that hasn't finished is counted
+            with trace.stage("read_wait"):
+                orig, stub, htm = inputs.result()
+        elif paths is not None:
+            orig, stub, htm = paths
+        else:
+            with trace.stage("paths"):
+                orig, stub, htm = get_filepaths(conversion_info, stub_loc, sd_loc, build)
+        converted_tree = fill_xml(htm, stub, orig, trace, backend, stream_size, cache)
+        with trace.stage("serialize"):
+            xml_bytes = serialize_tree(converted_tree)
+        if schema_loc is not None:
+            with trace.stage("validate"):
+                schema_validation.validate(xml_bytes, schema_loc)
+        return conversion_info, xml_bytes, None, trace
+    except Exception as err:
+        trace.set_error(trace.worker, instrumentation.get_error_info(err))
+        return conversion_info, None, (trace.worker, describe_error(err)), trace
+
+def build_failed(conversion_info, trace, failure, error_info):
+    """the result of a row whose project's html build failed, like convert_row's"""
+    trace.set_error(failure[0], error_info)
+    return conversion_info, None, failure, trace
+
+# the number of rows whose input files are read ahead of the one being converted,
+# the threads they're read on, and the bytes of read files that can be held
+# before more are read
+PREFETCH_DEPTH = 8
+PREFETCH_THREADS = 4
+PREFETCH_BUDGET = 64 * 1024 * 1024
+
+def read_row_inputs(conversion_info, stub_loc, sd_loc, index=None):
+    """reads a row's orig, stub and htm files into InputFiles, in the order
+    get_filepaths returns them. a file that can't be read is kept as its error"""
+    return tuple(read_input_file(path) for path in
+                 get_filepaths(conversion_info, stub_loc, sd_loc, build=False, index=index))
+
+def get_inputs_size(future):
+    """the bytes held by a finished read of a row's inputs"""
+    if future.exception() is not None:
+        return 0
+    return sum(len(input_file.data or b"") for input_file in future.result())
+
+class InputPrefetcher:
+    """reads the input files of rows ahead of their conversion on a few threads,
+    so the files of the next rows come over the network while a row is converted.
+    rows are read in the order they're added, up to depth at a time, and no more
+    are started while the reads hold budget bytes or more. a read that hasn't
+    finished is counted as the average size of the ones that have"""
+
+    def __init__(self, stub_loc, sd_loc, depth=PREFETCH_DEPTH, threads=PREFETCH_THREADS,
+                 budget=PREFETCH_BUDGET, index=None):
+        self.stub_loc = stub_loc
+        self.sd_loc = sd_loc
+        self.index = index
+        self.depth = depth
+        self.budget = budget
+        self._pool = ThreadPoolExecutor(max_workers=min(threads, depth),
+                                        thread_name_prefix="prefetch")
+        # rows waiting to be read, and the futures of the reads that have started
+        self._waiting = collections.OrderedDict()
+        self._reads = {}
+
+    def add(self, key, conversion_info):
+        """adds a row to read, under a key it's taken with. a row that's
+        already been added is left alone"""
+        if key not in self._reads and key not in self._waiting:
+            self._waiting[key] = conversion_info
+            self._start_reads()
+
+    def take(self, key):
+        """returns the future of a row's InputFiles, as read_row_inputs returns
+        them, starting the read if it hasn't started. the row is forgotten, so
+        the next one can be read"""
+        if key in self._waiting:
+            self._reads[key] = self._pool.submit(read_row_inputs, self._waiting.pop(key),
+                                                 self.stub_loc, self.sd_loc, self.index)
+        future = self._reads.pop(key)
+        self._start_reads()
+        return future
+
+    def _start_reads(self):
+        while self._waiting and len(self._reads) < self.depth:
+            sizes = [get_inputs_size(future) for future in self._reads.values() if future.done()]
+            unfinished = len(self._reads) - len(sizes)
+            held = sum(sizes) + (unfinished * sum(sizes) // len(sizes) if sizes else 0)
+            if held >= self.budget:
+                # the next read starts when a row is taken
+                break
+            key, conversion_info = self._waiting.popitem(last=False)
+            self._reads[key] = self._pool.submit(read_row_inputs, conversion_info,
+                                                 self.stub_loc, self.sd_loc, self.index)
 
-def main():
-    """ main entry to the migration program """
+    def close(self):
+        """stops the reads of rows that weren't taken, if they haven't started,
+        and waits for the rest"""
+        for future in self._reads.values():
+            future.cancel()
+        self._waiting.clear()
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def prefetch_inputs(rows, stub_loc, sd_loc, depth=PREFETCH_DEPTH, threads=PREFETCH_THREADS,
+                    budget=PREFETCH_BUDGET):
+    """yields (conversion_info, future) for each of rows, in order, where the future
+    holds the row's orig, stub and htm InputFiles for fill_xml. the files of the
+    next depth rows are read while the caller works on the current one"""
+    queued = collections.deque()
+    with InputPrefetcher(stub_loc, sd_loc, depth, threads, budget) as prefetcher:
+        for key, conversion_info in enumerate(rows):
+            prefetcher.add(key, conversion_info)
+            queued.append((key, conversion_info))
+            if len(queued) > depth:
+                key, conversion_info = queued.popleft()
+                yield conversion_info, prefetcher.take(key)
+        while queued:
+            key, conversion_info = queued.popleft()
+            yield conversion_info, prefetcher.take(key)
+
+# the number of rows that can be waiting on the pool per worker process
+PENDING_ROWS_PER_WORKER = 4
+
+def convert_rows(rows, stub_loc, sd_loc, workers=1, build_workers=1, build_command=None,
+                 backend=None, stream_size=ORIG_STREAM_SIZE, prefetch=PREFETCH_DEPTH,
+                 index=None, schema_loc=None, cache=None):
+    """yields (position, result) for each of rows, where result is what convert_row
+    returns for rows[position]. rows can be any iterable, and it's read as rows are
+    needed, so conversion starts before the end of a large manifest is read. the html
+    of each project that hasn't been built is built once, when its first row is read,
+    up to build_workers at a time. rows of a project being built are converted once
+    the build finishes, and every other row straight away, so results can come back
+    out of manifest order. if workers is more than 1, the rows are converted on a
+    pool of worker processes. the time of a project's build is added to the trace
+    of the row that started it. when rows are converted in this process, the input
+    files of the next prefetch rows that are ready to convert are read on threads
+    while a row is converted; 0 turns this off. if index is a path_index.PathIndex,
+    each row's input files are looked up in it as the row is read, and rows with a
+    missing file fail there, without a build or opening a file. schema_loc is
+    passed to convert_row, so rows are validated on the worker processes. so is
+    cache, an input_cache.InputCache; each worker process has its own"""
+    rows = enumerate(rows)
+    rows_read = False
+    # missing project html is always built here, so rows never build it themselves
+    convert = functools.partial(convert_row, stub_loc=stub_loc, sd_loc=sd_loc, build=False,
+                                backend=backend, stream_size=stream_size, schema_loc=schema_loc,
+                                cache=cache)
+
+    def get_row_paths(conversion_info):
+        # the paths are resolved here, so the index isn't sent to worker processes
+        if index is None:
+            return None
+        return get_filepaths(conversion_info, stub_loc, sd_loc, build=False, index=index)
+    pool = None
+    prefetcher = None
+    if workers > 1:
+        # build threads may be running when workers start, and forking a process
+        # with threads can deadlock, so workers are always spawned, like on windows
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context("spawn"))
+    elif prefetch > 0:
+        prefetcher = InputPrefetcher(stub_loc, sd_loc, depth=prefetch, index=index)
+    with ThreadPoolExecutor(max_workers=build_workers, thread_name_prefix="html-build") as build_pool:
+        checked = set()
+        # maps the futures of builds to their project and the trace of the row
+        # that started them, and the projects to their rows that are waiting for it
+        building = {}
+        waiting = {}
+        build_failures = {}
+        ready = collections.deque()
+        # maps the futures of rows on the pool to their position. only a bounded
+        # number of rows is sent at a time, so results don't pile up in memory
+        converting = {}
+        try:
+            while True:
+                # read rows until there are enough to convert
+                if pool is None:
+                    # the rows after the one converted next are read ahead
+                    wanted = 1 + prefetch
+                else:
+                    wanted = workers * PENDING_ROWS_PER_WORKER - len(converting)
+                while not rows_read and len(ready) < wanted:
+                    try:
+                        position, conversion_info = next(rows)
+                    except StopIteration:
+                        rows_read = True
+                        break
+                    project = conversion_info["project"]
+                    trace = instrumentation.RowTrace(conversion_info["title"], position)
+                    if index is not None:
+                        with trace.stage("check_inputs"):
+                            missing = get_missing_input(conversion_info, stub_loc, sd_loc, index)
+                        if missing is not None:
+                            failure = (multiprocessing.current_process().name,
+                                       describe_error(missing))
+                            yield position, build_failed(conversion_info, trace, failure,
+                                                         instrumentation.get_error_info(missing))
+                            continue
+                    if project not in checked:
+                        checked.add(project)
+                        build = start_build(project, sd_loc, build_pool, build_command)
+                        if build is not None:
+                            building[build] = (project, trace)
+                            waiting[project] = []
+                    if project in waiting:
+                        waiting[project].append((position, conversion_info, trace))
+                    elif project in build_failures:
+                        yield position, build_failed(conversion_info, trace,
+                                                     *build_failures[project])
+                    else:
+                        ready.append((position, conversion_info, trace))
+                if pool is None:
+                    if prefetcher is not None:
+                        # rows are only ready once their project's html is built
+                        for position, conversion_info, trace in itertools.islice(ready, prefetch + 1):
+                            prefetcher.add(position, conversion_info)
+                    if ready:
+                        position, conversion_info, trace = ready.popleft()
+                        if prefetcher is not None:
+                            yield position, convert(conversion_info, trace=trace,
+                                                    inputs=prefetcher.take(position))
+                        else:
+                            yield position, convert(conversion_info, trace=trace,
+                                                    paths=get_row_paths(conversion_info))
+                else:
+                    while ready and len(converting) < workers * PENDING_ROWS_PER_WORKER:
+                        position, conversion_info, trace = ready.popleft()
+                        converting[pool.submit(convert, conversion_info, trace=trace,
+                                               paths=get_row_paths(conversion_info))] = position
+                if not building and not converting:
+                    if ready or not rows_read:
+                        continue
+                    break
+                # only block when there's nothing left to convert in this process
+                done, _ = wait(building.keys() | converting.keys(),
+                               timeout=0 if pool is None and (ready or not rows_read) else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in converting:
+                        yield converting.pop(future), future.result()
+                        continue
+                    project, build_trace = building.pop(future)
+                    build_trace.add_time("build", future.result()[3])
+                    if index is not None:
+                        index.forget(get_htm_build_path(project, sd_loc))
+                    failure, error_info = get_build_failure(future, project, sd_loc)
+                    if failure is not None:
+                        build_failures[project] = (failure, error_info)
+                    for position, conversion_info, trace in waiting.pop(project):
+                        if failure is None:
+                            ready.append((position, conversion_info, trace))
+                        else:
+                            yield position, build_failed(conversion_info, trace,
+                                                         failure, error_info)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if prefetcher is not None:
+                prefetcher.close()
+
+# records the rows converted by earlier runs, one json object per line
+JOURNAL_FILE = "conversion_journal.jsonl"
+
+def get_input_fingerprint(conversion_info, stub_loc, sd_loc, index=None):
+    """the path, size and modification time of each of a row's three input files.
+    raises OSError if one of them is missing"""
+    fingerprint = []
+    for path in get_filepaths(conversion_info, stub_loc, sd_loc, build=False, index=index):
+        stat = os.stat(path)
+        fingerprint.append([path, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def read_journal(journal_file):
+    """reads the journal of earlier runs. returns a dict mapping each title
+    to the last entry recorded for it"""
+    entries = {}
+    if not os.path.exists(journal_file):
+        return entries
+    with open(journal_file) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of a run that was killed can be cut short
+                continue
+            entries[entry["row"]["title"]] = entry
+    return entries
+
+def rewrite_journal(journal_file, entries):
+    """replaces the journal with only the given entries"""
+    with open(journal_file + ".tmp", "w") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    os.replace(journal_file + ".tmp", journal_file)
+
+def is_up_to_date(entry, conversion_info, fingerprint):
+    """checks whether a journal entry shows the row was converted
+    from the same inputs, to an output file that's still there"""
+    return entry is not None and fingerprint is not None and \
+        entry["row"] == conversion_info and \
+        entry["inputs"] == fingerprint and \
+        os.path.exists(entry["output"])
+
+def skip_up_to_date(rows, journal, fingerprints, current, stub_loc, sd_loc, index=None):
+    """yields the rows that journal doesn't show are up to date. the journal
+    entries of the rows that are up to date are added to current, and the
+    input fingerprints of the others to fingerprints, by title"""
+    for conversion_info in rows:
+        try:
+            fingerprint = get_input_fingerprint(conversion_info, stub_loc, sd_loc, index)
+        except OSError:
+            # missing project html is built later on, and other missing files fail
+            fingerprint = None
+        entry = journal.get(conversion_info["title"])
+        if is_up_to_date(entry, conversion_info, fingerprint):
+            current[conversion_info["title"]] = entry
+        else:
+            fingerprints[conversion_info["title"]] = fingerprint
+            yield conversion_info
+
+def main(workers=1, build_workers=4, build_command=None, journal_file=JOURNAL_FILE, resume=True,
+         output_archive=None, trace_file=None, backend=None, stream_size=ORIG_STREAM_SIZE,
+         prefetch=PREFETCH_DEPTH, csv_locs=None, shard=None, validate=False, schema_loc=None,
+         cache_size=input_cache.CACHE_SIZE, cache_dir=None):
+    """ main entry to the migration program. workers sets the number of
+    processes used to convert files; 1 converts them serially. projects
+    that need their html built are built up to build_workers at a time,
+    with build_command if it's given. Each converted row is recorded in
+    journal_file, and if resume is True, rows whose inputs haven't changed
+    since they were recorded are skipped. If output_archive is given, the
+    files are written into that zip or tar file instead of the out folder.
+    If trace_file is given, the time each row spends in each stage, its
+    counters and its error are written to it as json lines, and the slowest
+    rows and stages are summarized at the end. backend names the xml_backend
+    the files are parsed and written with; lxml, when it's installed, by default.
+    Original documents larger than stream_size bytes are parsed a piece at a
+    time, keeping only the parts that are used. When files are converted
+    serially, the input files of the next prefetch rows are read while a row is
+    converted; 0 reads each row's files as it's converted. The rows of the
+    manifests in csv_locs, by default type_mismatch_3.csv, are converted, once
+    per Asset ID. If shard is given, as (index, shards), only the rows of the
+    projects sharding.get_shard gives to that shard are converted. If validate
+    is True, each file is checked against the WDCML schema, schema_loc or the
+    one in the depot, before it's written, and files that aren't valid fail.
+    Trees and params made from inputs with the same content as earlier ones are
+    kept in a cache of up to cache_size bytes, in each process, and in cache_dir
+    too if it's given, so a later run starts with them; 0 turns it off. The
+    cache's hits and misses are printed at the end """
     cwd = os.getcwd()
-    csv_loc = os.path.join(cwd, "type_mismatch_3.csv")
+    csv_locs = csv_locs or [os.path.join(cwd, "type_mismatch_3.csv")]
+    records = manifest.read_manifests(csv_locs)
+    if shard is not None:
+        records = sharding.select_shard(records, *shard)
 
     base_output_dir = "out"
     writers = ["aahi", "andki", "bagold", "domars", "dumacmic", "nabazan", "prwilk", "tedhudek"]
-    #get a mapping of projects with files that need to be converted
-    file_dict = get_file_mapping(csv_loc)
+    archive = None
+    if output_archive is not None:
+        # an archive is written whole, so every row is converted, and the
+        # journal, which records the out folder, is left alone
+        archive = OutputArchive(output_archive)
+        resume = False
+    # rows converted by an earlier run, or an earlier part of a run that was
+    # killed, are skipped if their inputs are the same. the manifest is read
+    # as rows are converted
+    journal = read_journal(journal_file) if resume else {}
+    fingerprints = {}
+    current = {}
+    # each folder of the depot and stubs a row's files are in is listed once, and
+    # rows with a missing input file fail before they're converted
+    index = path_index.PathIndex([stub_loc, sd_loc])
+    rows = skip_up_to_date(map(get_conversion_info, records), journal, fingerprints, current,
+                           stub_loc, sd_loc, index)
 
     #make output folders
     for writer in writers:
-        if not os.path.exists(base_output_dir):
+        if archive is None and not os.path.exists(base_output_dir):
             os.makedirs(os.path.join(base_output_dir, writer))
-    failed_files = []
+    # failures and written files are kept by manifest position, so the
+    # output is the same as converting the rows in order
+    failed_files = {}
+    written = {}
+    converted = 0
+    unchanged = 0
     
     #clear file containing filese that couldn't be converted,
     # before writing to it
     open("failed_files.txt", 'w').close()
-    # get file info, and start conversion
-    for conversion_info in file_dict.items():
-        try:
-            # prune conversion info to the stuff that helps
-            conversion_info = conversion_info[1]
-
-            print("converting: ", conversion_info["title"])
-            orig, stub, htm = get_filepaths(conversion_info, stub_loc, sd_loc)
-            converted_tree = fill_xml(htm, stub, orig)
-            owner = conversion_info["owner"].replace("REDMOND\\", "").replace("\n", "")
-            out = os.path.join(base_output_dir, owner, conversion_info["project"])
-            #make directory if needed
-            if not os.path.exists(out):
-                os.makedirs(out)
-            write_tree(converted_tree, conversion_info["title"], out)
-        # if an error occurs during the correction process, print it to the log file
-        except:
-            failure_str = "title: " +conversion_info["title"] + "\n" + \
-                "project: " + conversion_info["project"] + "\n" + \
-                "owner: " + conversion_info["owner"]
-            print("!!failure!!")
-            failed_files.append(failure_str)
+    # get file info, and start conversion. results are written here,
+    # so only one process touches the output tree
+    journal_f = open(journal_file, "a") if archive is None else None
+    # an unknown backend fails here, not on every row
+    backend = xml_backend.get_backend(backend).name
+    if validate:
+        # so is a schema that can't be compiled
+        schema_loc = schema_loc or schema_validation.get_schema_loc(sd_loc)
+        schema_validation.get_schema(schema_loc)
+    else:
+        schema_loc = None
+    # a run starts with an empty cache, or the one in cache_dir
+    cache = input_cache.InputCache(cache_size, cache_dir) if cache_size > 0 else None
+    cache_stats = collections.Counter()
+    trace_log = instrumentation.TraceLog(trace_file) if trace_file is not None else None
+    try:
+        for position, (conversion_info, xml_bytes, failure, trace) in convert_rows(
+                rows, stub_loc, sd_loc, workers, build_workers, build_command, backend,
+                stream_size, prefetch, index, schema_loc, cache):
+            cache_stats.update(trace.counters)
+            if failure is None:
+                write_start = time.perf_counter()
+                try:
+                    out = get_output_dir(conversion_info, base_output_dir)
+                    out_name = os.path.join(out, get_output_filename(conversion_info["title"]))
+                    out_file = os.path.normcase(out_name)
+                    # a later row with the same output file would have overwritten this one
+                    if written.get(out_file, -1) > position:
+                        continue
+                    written[out_file] = position
+                    if archive is not None:
+                        archive.write(out_name, xml_bytes)
+                        continue
+                    #make directory if needed
+                    if not os.path.exists(out):
+                        os.makedirs(out)
+                    if not write_serialized(xml_bytes, conversion_info["title"], out):
+                        unchanged += 1
+                    # the inputs of rows whose html was built weren't all there before
+                    fingerprint = fingerprints.pop(conversion_info["title"], None) or \
+                        get_input_fingerprint(conversion_info, stub_loc, sd_loc, index)
+                    entry = {"row": conversion_info, "inputs": fingerprint, "output": out_file}
+                    current[conversion_info["title"]] = entry
+                    converted += 1
+                    journal_f.write(json.dumps(entry) + "\n")
+                    # flushed each time, so a killed run picks up where it stopped
+                    journal_f.flush()
+                except Exception as err:
+                    failure = (multiprocessing.current_process().name, describe_error(err))
+                    trace.set_error(failure[0], instrumentation.get_error_info(err))
+                finally:
+                    trace.add_time("write", time.perf_counter() - write_start)
+                    if trace_log is not None:
+                        trace_log.write(trace)
+            elif trace_log is not None:
+                trace_log.write(trace)
+            # if an error occurs during the correction process, print it to the log file
+            if failure is not None:
+                print("!!failure!!", conversion_info["title"], "in", failure[0] + ":", failure[1])
+                failed_files[position] = get_failure_str(conversion_info, failure)
+                fingerprints.pop(conversion_info["title"], None)
+    except BaseException:
+        if archive is not None:
+            archive.close(keep=False)
+        raise
+    finally:
+        if journal_f is not None:
+            journal_f.close()
+        if trace_log is not None:
+            trace_log.close()
+    if archive is not None:
+        archive.close()
+    else:
+        skipped = len(current) - converted
+        if skipped > 0:
+            print("skipped", skipped, "files that were up to date")
+        if unchanged > 0:
+            print(unchanged, "converted files were unchanged, and weren't written again")
+        # the journal is only rewritten once a run finishes, with the rows that are up to date
+        rewrite_journal(journal_file, current.values())
+    if trace_log is not None:
+        trace_log.write_summary()
+        trace_log.print_summary()
+    if cache is not None:
+        print("input cache:")
+        for line in input_cache.get_stats_summary(cache_stats):
+            print("  ", line)
     
     with open("failed_files.txt","a") as f:
-        for failed in failed_files:
-            f.write(failed+"\n")
-
+        for position in sorted(failed_files):
+            f.write(failed_files[position]+"\n")
 
 def test():
     """test xml correction process on single file"""
@@ -388,8 +1293,69 @@ def test():
     test_xml_stub = name_base + "_stub.xml"
     test_orig_xml = name_base + "_orig.xml"
 
-    filled_tree = fill_xml(test_htm, test_xml_stub, test_orig_xml)
+    # ElementTree's own write is used, so the tree must be an ElementTree one
+    filled_tree = fill_xml(test_htm, test_xml_stub, test_orig_xml, backend="etree")
 
     filled_tree.write(open('test_'+filename+'.xml', 'wb'))
 
-main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fixes xml files that have a page type mismatch")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of worker processes to convert files with (default: 1, serial)")
+    parser.add_argument("--build-workers", type=int, default=4,
+                        help="number of project html builds to run at once (default: 4)")
+    parser.add_argument("--build-command",
+                        help="command to build a project's html with, run from the project folder "
+                             "(default: CbX msdn hxs_msdn, through powershell)")
+    parser.add_argument("--journal", default=JOURNAL_FILE,
+                        help="file recording the converted files (default: " + JOURNAL_FILE + ")")
+    parser.add_argument("--full", action="store_true",
+                        help="convert every file, even ones the journal shows are up to date")
+    parser.add_argument("--archive",
+                        help="write the converted files into this .zip, .tar, .tar.gz or .tgz "
+                             "file, instead of the out folder. every file is converted")
+    parser.add_argument("--trace",
+                        help="write the time each file spends in each stage of the conversion, "
+                             "and its error, to this json lines file, and summarize the slowest "
+                             "files and stages at the end")
+    parser.add_argument("--xml-backend", choices=sorted(xml_backend.BACKENDS),
+                        help="parse and write the xml with lxml or xml.etree "
+                             "(default: lxml, if it's installed)")
+    parser.add_argument("--stream-size", type=int, default=ORIG_STREAM_SIZE,
+                        help="parse original documents larger than this many bytes a piece at "
+                             "a time, keeping only the parts that are used; 0 does it for every "
+                             "document (default: " + str(ORIG_STREAM_SIZE) + ")")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH,
+                        help="when converting serially, read the input files of this many rows "
+                             "ahead of the one being converted; 0 turns it off "
+                             "(default: " + str(PREFETCH_DEPTH) + ")")
+    parser.add_argument("--manifest", action="append", dest="manifests",
+                        help="a manifest to convert the rows of; can be given more than once, and "
+                             "rows are converted once per Asset ID (default: type_mismatch_3.csv)")
+    parser.add_argument("--shard", type=sharding.parse_shard,
+                        help="only convert the projects of one shard, given as index/shards, e.g. "
+                             "2/4. see sharding.py to plan shards and merge their output")
+    parser.add_argument("--validate", action="store_true",
+                        help="check each file against the WDCML schema before it's written, and "
+                             "fail the files that aren't valid. needs lxml")
+    parser.add_argument("--schema",
+                        help="the wdcml.xsd to validate against (default: the one in the depot, "
+                             "under " + schema_validation.SCHEMA_PATH + ")")
+    parser.add_argument("--cache-size", type=int, default=input_cache.CACHE_SIZE,
+                        help="bytes of parsed trees and scraped params to keep in memory, in each "
+                             "process, for inputs with the same content as earlier ones; 0 turns "
+                             "the cache off (default: " + str(input_cache.CACHE_SIZE) + ")")
+    parser.add_argument("--cache-dir",
+                        help="also keep the preprocessed xml and scraped params in this folder, "
+                             "so later runs start with them")
+    args = parser.parse_args()
+    # windows paths in the command keep their backslashes
+    build_command = None
+    if args.build_command:
+        build_command = shlex.split(args.build_command, posix=(os.name != "nt"))
+    main(workers=args.workers, build_workers=args.build_workers, build_command=build_command,
+         journal_file=args.journal, resume=not args.full, output_archive=args.archive,
+         trace_file=args.trace, backend=args.xml_backend, stream_size=args.stream_size,
+         prefetch=args.prefetch, csv_locs=args.manifests, shard=args.shard,
+         validate=args.validate or args.schema is not None, schema_loc=args.schema,
+         cache_size=args.cache_size, cache_dir=args.cache_dir)